@@ -0,0 +1,128 @@
+# Optional fixed-record binary store of every reading, next to SQLite (config.BINARY_STORE)
+# freyr.py writes exactly one sample per aligned minute, so the record for epoch T always sits at
+#   HEADER_SIZE + (T - t0) // step * RECORD_DTYPE.itemsize
+# and a time range is a slice of a memory-mapped NumPy array: no index, no query, no copy
+# Minutes without a sample are NaN records, so the offsets never shift
+# Run from the same directory as 'freyr.py':
+#   python binstore.py build  - (re)build the store from freyr.db and its archives
+#   python binstore.py info   - show what's in it
+import config
+import sqlite3
+import math
+import os
+import sys
+import time
+import numpy as np
+
+MAGIC = b"FREYRTS1"
+HEADER_SIZE = 64 # MAGIC, t0, step, record size, then zeros
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("t0", "<i8"), ("step", "<i8"), ("record_size", "<i8")])
+STEP = 60 # seconds, one record per aligned minute
+# One float32 per reading (plenty for 3-4 significant figures), in the order update_sqlite_database() takes them
+# The datetime and epoch aren't stored, they follow from the record's position
+RECORD_DTYPE = np.dtype([(field, "<f4") for field in ["outdoorTemp", "outdoorDewpoint", "outdoorHumidity", "indoorTemp", "indoorDewpoint",
+    "indoorHumidity", "localPressure", "uv", "wind", "windGust", "indoorGas", "piTemp", "picowTemp"]])
+
+def create(path, t0):
+    header = np.array([(MAGIC, t0 - t0 % STEP, STEP, RECORD_DTYPE.itemsize)], dtype=HEADER_DTYPE)
+    with open(path, "wb") as file:
+        file.write(header.tobytes().ljust(HEADER_SIZE, b"\0"))
+
+def read_header(path):
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+    if header["magic"] != MAGIC or header["record_size"] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path} isn't a freyr binary store with this record layout")
+    return int(header["t0"]), int(header["step"])
+
+# Open for writing, created with t0 = 'epoch' if it doesn't exist yet
+# Returns (file, t0, step)
+def open_for_append(path, epoch):
+    if not os.path.exists(path):
+        create(path, epoch)
+    t0, step = read_header(path)
+    return open(path, "r+b"), t0, step
+
+GAP = np.array([(math.nan,) * len(RECORD_DTYPE.names)], dtype=RECORD_DTYPE) # A minute without a sample
+
+def to_records(rows):
+    return np.array([tuple(math.nan if value == 'U' or value is None else value for value in values) for values in rows], dtype=RECORD_DTYPE)
+
+def append(store, epoch, values):
+    write(store, np.array([epoch]), to_records([values]))
+
+# Writes records at the slots for 'epochs', which are sorted and no earlier than the last record written
+# NaN records fill any minutes missed since then, a slot that was already written (a repeated tick) is overwritten
+def write(store, epochs, new_records):
+    file, t0, step = store
+    slots = (epochs - t0) // step
+    if slots[0] < 0:
+        raise ValueError(f"Epoch {epochs[0]} is before the start of the store ({t0})")
+    end = (file.seek(0, os.SEEK_END) - HEADER_SIZE) // RECORD_DTYPE.itemsize # Also drops a half written last record
+    first = min(slots[0], end)
+    block = np.repeat(GAP, slots[-1] + 1 - first)
+    block[slots - first] = new_records
+    file.seek(HEADER_SIZE + first * RECORD_DTYPE.itemsize)
+    file.write(block.tobytes())
+    file.flush() # Readers map the file, they see it as soon as it's in the page cache
+
+# (t0, step, records): records is a read-only memory map of every complete record
+# Mapping is just an mmap() call, so readers map it again whenever they need to see new records
+def load(path):
+    t0, step = read_header(path)
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return t0, step, np.empty(0, dtype=RECORD_DTYPE)
+    return t0, step, np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+# Record for one epoch, or None if it's outside the store. O(1)
+def lookup(store, epoch):
+    t0, step, records = store
+    slot = (epoch - t0) // step
+    return records[slot] if 0 <= slot < len(records) else None
+
+# (epochs, records) for [start, end], records is a view into the map rather than a copy
+def window(store, start, end):
+    t0, step, records = store
+    first = max(0, -((t0 - start) // step)) # First slot at or after start
+    last = min(len(records), (end - t0) // step + 1)
+    first = min(first, last)
+    return t0 + step * np.arange(first, last, dtype=np.int64), records[first:last]
+
+# Writes every row out of freyr.db and its archives into a new store, oldest first
+def build(path):
+    from export import rows # Only needed here
+    connection = sqlite3.connect(f"file:{config.DATABASE_PATH + config.DATABASE}?mode=ro", uri=True)
+    new_path = path + ".new"
+    store = None
+    count = 0
+    for chunk in rows(connection, 0, int(time.time())):
+        if store is None:
+            if os.path.exists(new_path):
+                os.remove(new_path)
+            store = open_for_append(new_path, chunk[0][1])
+        write(store, np.array([row[1] for row in chunk], dtype=np.int64),
+            to_records([value if isinstance(value, (int, float)) else None for value in row[2:]] for row in chunk))
+        count += len(chunk)
+    connection.close()
+    if store is None:
+        print("No rows to build from")
+        return
+    store[0].close()
+    os.replace(new_path, path)
+    print(f"Built {path} from {count} rows")
+
+def info(path):
+    t0, step, records = load(path)
+    print(f"t0 {t0}, step {step} seconds, {len(records)} records of {RECORD_DTYPE.itemsize} bytes ({os.path.getsize(path) / 1048576:.2f} MB)")
+    if len(records):
+        print(f"Last record: epoch {t0 + step * (len(records) - 1)}")
+
+if __name__ == "__main__":
+    commands = {"build": build, "info": info}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        print(f"Usage: python {sys.argv[0]} {'|'.join(commands)}")
+        sys.exit(1)
+    if not config.BINARY_STORE:
+        print("Set BINARY_STORE in config.py first")
+        sys.exit(1)
+    commands[sys.argv[1]](config.BINARY_STORE)
@@ -0,0 +1,122 @@
+# Streams history out of freyr.db and its monthly archives a chunk at a time, so exporting years of data
+# takes the same (small) amount of memory as exporting a day
+# Used by freyrFlask.py's /api/export, or run from the same directory as 'freyr.py':
+#   python export.py csv|ndjson|npy [start] [end] > file
+# start/end are epoch seconds (default: everything)
+#
+# Formats:
+#   csv    - header row of /api field names, empty for no data
+#   ndjson - one JSON object per line, /api field names, null for no data
+#   npy    - NumPy structured array (epoch + every reading, NaN for no data), np.load(path, mmap_mode='r') maps it without reading it in
+import config
+import sqlite3
+import csv
+import io
+import json
+import math
+import sys
+import time
+import numpy as np
+from sqlite_schema import archives
+
+# Field names as /api returns them, in the data table's column order
+FIELDS = ["time", "epoch", "outdoorTemp", "outdoorDewpoint", "outdoorHumidity", "indoorTemp", "indoorDewpoint", "indoorHumidity",
+    "localPressure", "uv", "wind", "windGust", "indoorGas", "piTemp", "picowTemp"]
+CHUNK_ROWS = 1000 # Rows per fetchmany(), and per chunk written out
+NPY_DTYPE = np.dtype([("epoch", "<i8")] + [(field, "<f8") for field in FIELDS[2:]])
+
+# A reading, or None for no data ('U' on the original schema)
+def number(value):
+    return value if isinstance(value, (int, float)) else None
+
+# Runs 'query' (with a {schema} placeholder) against every archive for [start, end], oldest first, then freyr.db
+# Yields lists of up to CHUNK_ROWS rows. Archives are ATTACHed one at a time and detached again even if the
+# generator is closed part way through (a client that disconnected)
+def chunks(connection, query, start, end):
+    for path in archives(start, end):
+        connection.execute("ATTACH DATABASE ? AS archive", (f"file:{path}?mode=ro",))
+        try:
+            yield from fetch(connection.execute(query.format(schema="archive"), (start, end)))
+        finally:
+            connection.execute("DETACH DATABASE archive")
+    yield from fetch(connection.execute(query.format(schema="main"), (start, end)))
+
+def fetch(cursor):
+    try:
+        while True:
+            rows = cursor.fetchmany(CHUNK_ROWS)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close() # An unfinished statement would keep its database locked
+
+def epoch_column(connection):
+    return connection.execute("PRAGMA table_info(data)").fetchall()[1][1]
+
+def rows(connection, start, end):
+    epoch = epoch_column(connection)
+    return chunks(connection, f'SELECT * FROM {{schema}}.data WHERE "{epoch}" BETWEEN ? AND ? ORDER BY "{epoch}"', start, end)
+
+def count(connection, start, end):
+    epoch = epoch_column(connection)
+    return sum(chunk[0][0] for chunk in chunks(connection, f'SELECT COUNT(*) FROM {{schema}}.data WHERE "{epoch}" BETWEEN ? AND ?', start, end))
+
+def export_csv(connection, start, end):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for chunk in rows(connection, start, end):
+        writer.writerows((row[0], row[1], *("" if number(value) is None else value for value in row[2:])) for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue() # Just the header if there were no rows
+
+def export_ndjson(connection, start, end):
+    for chunk in rows(connection, start, end):
+        yield "".join(json.dumps(dict(zip(FIELDS, (row[0], row[1], *(number(value) for value in row[2:]))))) + "\n" for row in chunk)
+
+# The .npy header has the row count in it, so rows are counted first
+# If the collector or the archive job changes the range while it streams, the body is cut off or padded
+# (epoch 0, NaN readings) to the count in the header, so the file always loads
+def export_npy(connection, start, end):
+    total = count(connection, start, end)
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {"descr": np.lib.format.dtype_to_descr(NPY_DTYPE), "fortran_order": False, "shape": (total,)})
+    yield header.getvalue()
+    written = 0
+    stream = rows(connection, start, end)
+    try:
+        for chunk in stream:
+            chunk = chunk[:total - written]
+            if not chunk:
+                break
+            yield np.array([(row[1], *(math.nan if number(value) is None else value for value in row[2:])) for row in chunk], dtype=NPY_DTYPE).tobytes()
+            written += len(chunk)
+    finally:
+        stream.close()
+    if written < total:
+        padding = np.zeros(total - written, dtype=NPY_DTYPE)
+        for field in FIELDS[2:]:
+            padding[field] = math.nan
+        yield padding.tobytes()
+
+# format: (generator, mimetype)
+EXPORTERS = {
+    "csv": (export_csv, "text/csv"),
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+    "npy": (export_npy, "application/octet-stream")
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3, 4) or sys.argv[1] not in EXPORTERS:
+        print(f"Usage: python {sys.argv[0]} {'|'.join(EXPORTERS)} [start] [end] > file")
+        sys.exit(1)
+    start = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    end = int(sys.argv[3]) if len(sys.argv) > 3 else int(time.time())
+    connection = sqlite3.connect(f"file:{config.DATABASE_PATH + config.DATABASE}?mode=ro", uri=True)
+    exporter, mimetype = EXPORTERS[sys.argv[1]]
+    for part in exporter(connection, start, end):
+        sys.stdout.buffer.write(part.encode() if isinstance(part, str) else part)
+    connection.close()
@@ -1,8 +1,10 @@
 import config
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 import bme680
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import rrdtool
 import vcgencmd
 import math
@@ -11,10 +13,22 @@ from logging.handlers import RotatingFileHandler
 import sqlite3
 import signal
 import sys
+import heapq
+import threading
+import json
+import os
+import multiprocessing
+from graphs import rrd_daemon_args, graph_definitions, graph_interval, graph_sources, render_graph
+from sqlite_schema import COMPACT_VERSION, INSERT_SAMPLE, encode_row, schema_version, archive
+import binstore
+from concurrent.futures import ThreadPoolExecutor, wait
 
 def init():
-    global connection, cursor
+    global connection, cursor, compact_schema
     global sensor
+    global executor, refresh_executor
+    global session
+    global renderer_pool
 
     # Set up logging
     logging.basicConfig(
@@ -23,11 +37,51 @@ def init():
         format='%(asctime)s - %(levelname)s - %(message)s')
     logging.warning("Starting freyr") # Throw something in the log on start just so I know everything is working
 
+    # Renderer processes for the graphs, forked first thing before any other threads exist
+    # Not needed when freyrFlask.py renders graphs on demand
+    renderer_pool = None
+    if not config.GRAPHS_ON_DEMAND:
+        renderer_pool = multiprocessing.Pool(processes=config.RENDER_PROCESSES, initializer=renderer_process_init)
+
+    # One long-lived HTTP session shared by every fetcher and sink
+    # Keeps connections alive per host so we don't pay for a new TCP/TLS handshake every cycle
+    session = requests.Session()
+    retries = Retry(
+        total=config.HTTP_RETRIES,
+        connect=0, # No retries on connection errors or timeouts: with timeout=5 each retry would add another 5 seconds,
+        read=0, # eating into COLLECT_DEADLINE and delaying the circuit breakers' fast failure. Dead hosts fail once
+        status=config.HTTP_RETRIES, # Only 5xx responses (status_forcelist) are retried
+        backoff_factor=config.HTTP_BACKOFF, # Sleeps backoff_factor * 2^(retry - 1) seconds between retries
+        status_forcelist=(500, 502, 503, 504), # Don't retry 429, that only makes rate limiting worse
+        raise_on_status=False) # Hand the last response back so raise_for_status() and the except clauses below still work
+    adapter = HTTPAdapter(pool_connections=config.HTTP_POOL_HOSTS, pool_maxsize=config.HTTP_POOL_SIZE, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    load_api_cache()
+
+    # Read the last update time of every RRD once, update_rrd() keeps them current from here on
+    for rrd_filename in RRD_FILES:
+        load_rrd_last(rrd_filename)
+
     # Connect to SQLite db
     try:
         logging.info(f"Connecting to SQLite database")
         connection = sqlite3.connect(config.DATABASE_PATH + config.DATABASE)
         cursor = connection.cursor()
+        # WAL lets freyrFlask.py read while we write, and synchronous=NORMAL only fsyncs at checkpoints instead of every commit
+        journal_mode = cursor.execute(f"PRAGMA journal_mode = {config.SQLITE_JOURNAL_MODE}").fetchone()[0]
+        cursor.execute(f"PRAGMA synchronous = {config.SQLITE_SYNCHRONOUS}")
+        logging.info(f"SQLite journal mode: {journal_mode}, synchronous: {config.SQLITE_SYNCHRONOUS}")
+        # Compact schema (see sqlite_schema.py): rows go into the samples table, already keyed by epoch
+        compact_schema = schema_version(connection) == COMPACT_VERSION
+        logging.info(f"SQLite schema: {'compact' if compact_schema else 'original'}")
+        if not compact_schema:
+            # Index on epoch for freyrFlask.py's history queries, the data table is written in epoch order so it stays cheap to maintain
+            epoch_column = cursor.execute("PRAGMA table_info(data)").fetchall()[1][1] # Second column, same place the INSERT puts epoch
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS data_epoch ON data ("{epoch_column}")')
+        create_rollups()
+        connection.commit()
     except Exception as e:
         logging.error(f"Couldn't open SQLite database: {e}")
 
@@ -58,6 +112,16 @@ def init():
     sensor.set_temp_offset(offset)
     # Done initializing BME680
 
+    # Thread pool for polling all sources at the same time
+    # One worker per source so a slow source never waits behind another one (collect_sources() never runs a source twice at once)
+    executor = ThreadPoolExecutor(max_workers=len(SOURCES), thread_name_prefix="source")
+    # Background API refreshes get their own worker, so they never queue a source up past its deadline
+    refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refresh")
+
+    # Graphs render in the background, see request_render()
+    if renderer_pool:
+        threading.Thread(target=renderer, name="renderer", daemon=True).start()
+
 # Global Celsius to Fahrenheit conversion function
 def c_to_f(temp_c):
     return (temp_c * 1.8) + 32.0
@@ -76,6 +140,83 @@ def calc_dewpoint(humidity, temp_c):
     alpha = math.log(humidity/100.0) + ((a * temp_c) / (b + temp_c))
     return (b * alpha) / (a - alpha)
 
+# Circuit breakers for flaky upstream sources
+# After config.BREAKER_THRESHOLD failures in a row a source's breaker opens and calls are skipped straight away ('U')
+# instead of waiting out the full timeout every cycle. Once the backoff has passed a single probe call is let through:
+# success closes the breaker, failure re-opens it with the backoff doubled (up to config.BREAKER_MAX_BACKOFF)
+breakers = {} # name: {"state", "failures", "opened", "backoff", "transitions"}
+breaker_lock = threading.Lock() # Sources run in threads
+
+class CircuitOpen(Exception):
+    pass
+
+# Call with breaker_lock held
+def breaker_transition(name, breaker, state):
+    transition = f"{breaker['state']}->{state}"
+    breaker["transitions"][transition] = breaker["transitions"].get(transition, 0) + 1
+    logging.warning(f"Circuit breaker '{name}': {transition}")
+    breaker["state"] = state
+
+# Raises CircuitOpen if the source shouldn't be called right now
+def breaker_allow(name):
+    with breaker_lock:
+        breaker = breakers.setdefault(name, {"state": "closed", "failures": 0, "opened": 0.0, "backoff": config.BREAKER_BACKOFF, "transitions": {}})
+        if breaker["state"] == "closed":
+            return
+        if breaker["state"] == "open" and time.monotonic() - breaker["opened"] >= breaker["backoff"]:
+            breaker_transition(name, breaker, "half_open") # Let this one call through as a probe
+            return
+        raise CircuitOpen(f"Circuit breaker '{name}' is {breaker['state']}, skipping call")
+
+def breaker_success(name):
+    with breaker_lock:
+        breaker = breakers[name]
+        if breaker["state"] != "closed":
+            breaker_transition(name, breaker, "closed")
+        breaker["failures"] = 0
+        breaker["backoff"] = config.BREAKER_BACKOFF
+
+def breaker_failure(name):
+    with breaker_lock:
+        breaker = breakers[name]
+        breaker["failures"] += 1
+        if breaker["state"] == "half_open":
+            breaker["backoff"] = min(breaker["backoff"] * 2, config.BREAKER_MAX_BACKOFF) # Probe failed, wait longer next time
+        elif breaker["state"] == "closed" and breaker["failures"] < config.BREAKER_THRESHOLD:
+            return
+        breaker_transition(name, breaker, "open")
+        breaker["opened"] = time.monotonic()
+
+# The probe breaker_allow() let through never went out (no quota left), so there's no outcome to record
+# Back to open with the same backoff and opening time, the next call is allowed to probe straight away
+def breaker_release(name):
+    with breaker_lock:
+        breaker = breakers[name]
+        if breaker["state"] == "half_open":
+            breaker_transition(name, breaker, "open")
+
+# GET through the shared session and record the outcome on the source's breaker
+# Call breaker_allow() first
+def breaker_get(name, url, **kwargs):
+    try:
+        response = session.get(url, **kwargs)
+        response.raise_for_status() # If error, try to catch it in the caller's except clauses
+    except requests.exceptions.RequestException:
+        breaker_failure(name)
+        raise
+    breaker_success(name)
+    return response
+
+# Snapshot of every breaker for logging or inspection
+def breaker_status():
+    with breaker_lock:
+        return {name: {"state": b["state"], "failures": b["failures"], "backoff": b["backoff"], "transitions": dict(b["transitions"])} for name, b in breakers.items()}
+
+def log_breaker_status():
+    for name, status in breaker_status().items():
+        level = logging.INFO if status["state"] == "closed" else logging.WARNING
+        logging.log(level, f"Circuit breaker '{name}' - state: {status['state']} failures: {status['failures']} backoff: {status['backoff']} s transitions: {status['transitions']}")
+
 # Outdoor Pi Pico W + Si7021 sensor function
 def get_outdoor():
     logging.info("Outdoor sensor data:")
@@ -83,8 +224,8 @@ def get_outdoor():
         offset = 0.0 # Sensor correction in degrees C
         # Initialize variables so if request fails graphs still populate with NaN
         outdoor_c = outdoor_hum = outdoor_dew = picow_temp_c = 'U'
-        responseSatellite = requests.get(config.SATELLITE, timeout=5)
-        responseSatellite.raise_for_status() # If error, try to catch it in except clauses below
+        breaker_allow("outdoor")
+        responseSatellite = breaker_get("outdoor", config.SATELLITE, timeout=5) # If error, try to catch it in except clauses below
         # Code below here will only run if the request is successful
         outdoor_c = responseSatellite.json()['temperature'] + offset
         outdoor_f = c_to_f(outdoor_c)
@@ -105,8 +246,119 @@ def get_outdoor():
         logging.error(errt)
     except requests.exceptions.RequestException as err:
         logging.error(err)
+    except CircuitOpen as errb:
+        logging.info(errb)
     return outdoor_c, outdoor_hum, outdoor_dew, picow_temp_c
 
+# Response cache for the weather APIs
+# Upstream data only refreshes every 10-15 minutes, so there's no point asking more often than that
+# Each API in config.API_LIMITS gets:
+#   ttl   - seconds a response is served straight from the cache
+#   stale - seconds past ttl a response is still served while a refresh runs in the background
+#   burst, per_day - token bucket for the API key, a request is only sent if there's a token for it
+api_cache = {} # name: {"data": parsed JSON, "fetched": time.time()}
+api_buckets = {} # name: {"tokens": tokens left, "updated": time.time()}
+api_refreshing = set() # names with a background refresh in flight
+api_lock = threading.Lock() # Sources run in threads
+
+class RateLimited(Exception):
+    pass
+
+# Load cached responses and token buckets from disk so a restart doesn't burn quota
+def load_api_cache():
+    global api_cache, api_buckets
+    if not config.API_CACHE_FILE:
+        return
+    try:
+        with open(config.API_CACHE_FILE) as f:
+            saved = json.load(f)
+        api_cache = saved["cache"]
+        api_buckets = saved["buckets"]
+        logging.info(f"Loaded API cache from {config.API_CACHE_FILE}")
+    except FileNotFoundError:
+        logging.info(f"No API cache at {config.API_CACHE_FILE} yet")
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"Couldn't load API cache {config.API_CACHE_FILE}: {e}")
+
+# Call with api_lock held
+def save_api_cache():
+    if not config.API_CACHE_FILE:
+        return
+    try:
+        temp_file = config.API_CACHE_FILE + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"cache": api_cache, "buckets": api_buckets}, f)
+        os.replace(temp_file, config.API_CACHE_FILE) # Atomic, a crash mid-write can't leave a half written cache
+    except OSError as e:
+        logging.error(f"Couldn't save API cache {config.API_CACHE_FILE}: {e}")
+
+# Take a token from the API's bucket, returns False if the quota is used up
+# Call with api_lock held
+def take_token(name):
+    limits = config.API_LIMITS[name]
+    now = time.time()
+    bucket = api_buckets.setdefault(name, {"tokens": limits["burst"], "updated": now})
+    refill = (now - bucket["updated"]) * limits["per_day"] / 86400
+    bucket["tokens"] = min(limits["burst"], bucket["tokens"] + refill)
+    bucket["updated"] = now
+    if bucket["tokens"] < 1:
+        return False
+    bucket["tokens"] -= 1
+    return True
+
+# Send the request and store the response. Raises requests exceptions, RateLimited and CircuitOpen
+def refresh_api(name, url, params):
+    breaker_allow(name) # Before taking a token, an open breaker shouldn't spend quota
+    with api_lock:
+        allowed = take_token(name)
+    if not allowed:
+        breaker_release(name)
+        raise RateLimited(f"{name} quota used up, not sending request")
+    response = breaker_get(name, url, params=params, timeout=5) # If error, try to catch it in the fetcher's except clauses
+    data = response.json()
+    with api_lock:
+        api_cache[name] = {"data": data, "fetched": time.time()}
+        save_api_cache()
+    return data
+
+def refresh_api_background(name, url, params):
+    try:
+        refresh_api(name, url, params)
+        logging.info(f"Refreshed {name} in the background")
+    except (requests.exceptions.RequestException, RateLimited, CircuitOpen) as e:
+        logging.error(f"Background refresh of {name} failed: {e}")
+    finally:
+        with api_lock:
+            api_refreshing.discard(name)
+
+# GET a JSON API through the cache
+# 'interval' is how often the calling source runs. Serving the stale copy while refreshing in the background only pays off
+# if the refreshed copy is still fresh at the source's next tick (interval < ttl). A source that runs less often than the
+# TTL would otherwise write the previous fetch every time, so it refreshes right away and only gets the stale copy if that fails
+def cached_get(name, url, params, interval):
+    limits = config.API_LIMITS[name]
+    with api_lock:
+        entry = api_cache.get(name)
+        age = time.time() - entry["fetched"] if entry else None
+        if entry and age < limits["ttl"]:
+            logging.info(f"{name} cache hit, {age:.0f} seconds old")
+            return entry["data"]
+        usable = entry and age < limits["ttl"] + limits["stale"]
+        if usable and interval < limits["ttl"]:
+            # Serve the stale copy now and refresh it for next time
+            if name not in api_refreshing:
+                api_refreshing.add(name)
+                refresh_executor.submit(refresh_api_background, name, url, params)
+            logging.info(f"{name} cache stale, {age:.0f} seconds old. Refreshing in the background")
+            return entry["data"]
+    try:
+        return refresh_api(name, url, params)
+    except (requests.exceptions.RequestException, RateLimited, CircuitOpen) as e:
+        if not usable:
+            raise
+        logging.warning(f"{name} refresh failed ({e}), serving cached copy {age:.0f} seconds old")
+        return entry["data"]
+
 def get_OpenUV_Index():
     logging.info("Fetching data from OpenUV:")
     uv = 'U' # Set to rrdtool's definition of NaN if request fails
@@ -119,9 +371,8 @@ def get_OpenUV_Index():
         "alt": config.STA_ALT,
         "dt": ""  # If you want to specify a datetime, you can put it here
     }
-    sessionOpenUV = requests.Session() # Initialize session for reuse during API calls
     try:
-        responseOpenUV = sessionOpenUV.get(urlOpenUV, headers=headersOpenUV, params=paramsOpenUV, timeout=9)
+        responseOpenUV = session.get(urlOpenUV, headers=headersOpenUV, params=paramsOpenUV, timeout=9)
         responseOpenUV.raise_for_status() # If error, try to catch it in except clauses below
         # Code below here will only run if the request is successful
         uv = responseOpenUV.json()['result']['uv']
@@ -136,7 +387,7 @@ def get_OpenUV_Index():
     except requests.exceptions.Timeout as errt:
         logging.error(errt)
         logging.error("OpenUV API request timed out. Checking status URL...")
-        r = requests.get("https://api.openuv.io/api/v1/status", headers=headersOpenUV) # Check if the API is down or not responding
+        r = session.get("https://api.openuv.io/api/v1/status", headers=headersOpenUV) # Check if the API is down or not responding
         logging.error(f"OpenUV API status: {r.status_code} - {r.text}")
         if r.json()['status']:
             logging.error("Hmmm, the OpenUV API seems to be up, but the request timed out. Maybe try again later?")
@@ -158,18 +409,16 @@ def get_Open_Meteo():
         "timeformat": "unixtime"
         # "temporal_resolution": "native"
     }
-    sessionOpen_Meteo = requests.Session() # Initialize session for reuse during API calls
     try:
-        responseOpen_Meteo = sessionOpen_Meteo.get(urlOpen_Meteo, params=paramsOpen_Meteo, timeout=5)
-        responseOpen_Meteo.raise_for_status() # If error, try to catch it in except clauses below
+        dataOpen_Meteo = cached_get("open_meteo", urlOpen_Meteo, paramsOpen_Meteo, config.SCHEDULE["uv"][0])
         # Code below here will only run if the request is successful
-        uv = responseOpen_Meteo.json()['current']['uv_index']
+        uv = dataOpen_Meteo['current']['uv_index']
         logging.info(f"UV Index: {uv}")
         if uv == 'U':
             logging.error("Something bad happened. Figure out how to debug it.")
     except requests.exceptions.HTTPError as errh: # If the error is an HTTP error code, then:
         logging.error(errh) # log error code, example " - ERROR - 403 Client Error: Forbidden for url:"
-        logging.error(f"Full Response: {responseOpen_Meteo.json()}") # Show full JSON response
+        logging.error(f"Full Response: {errh.response.text}") # Show full JSON response
     except requests.exceptions.ConnectionError as errc:
         logging.error(errc)
     except requests.exceptions.Timeout as errt:
@@ -177,6 +426,10 @@ def get_Open_Meteo():
         logging.error("Open-Meteo API request timed out. Write some debug code to figure out why?")
     except requests.exceptions.RequestException as err:
         logging.error(err)
+    except RateLimited as errl:
+        logging.error(errl)
+    except CircuitOpen as errb:
+        logging.info(errb)
     return uv
 
 def get_OWM():
@@ -191,23 +444,26 @@ def get_OWM():
         "units": "imperial"
     }
     try:
-        responseOWM = requests.get(urlOWM, params=paramsOWM, timeout=5)
-        responseOWM.raise_for_status() # If error, try to catch it in except clauses below
+        dataOWM = cached_get("owm", urlOWM, paramsOWM, config.SCHEDULE["owm"][0])
         # Code below here will only run if the request is successful
-        w = responseOWM.json()['wind'] # take the 'wind' key values and throw them in 'w'
+        w = dataOWM['wind'] # take the 'wind' key values and throw them in 'w'
         wind = w['speed'] if 'speed' in w and w['speed'] is not None else 'U'
         windGust = w['gust'] if 'gust' in w and w['gust'] is not None else 'U'
         logging.info(f"Wind: {wind} mph") if wind != 'U' else logging.warning("Wind data not available.")
         logging.info(f"Gust: {windGust} mph") if windGust != 'U' else logging.warning("Gust data not available.")
     except requests.exceptions.HTTPError as errh: # If the error is an HTTP error code, then:
         logging.error(errh) # log error code, example "- ERROR - 429 Client Error: Too Many Requests for url:"
-        logging.error(f"Full Response: {responseOWM.json()}") # Show full JSON response, Expected key should be "cod" "message" and "parameters"
+        logging.error(f"Full Response: {errh.response.text}") # Show full JSON response, Expected key should be "cod" "message" and "parameters"
     except requests.exceptions.ConnectionError as errc:
         logging.error(errc)
     except requests.exceptions.Timeout as errt:
         logging.error(errt)
     except requests.exceptions.RequestException as err:
         logging.error(err)
+    except RateLimited as errl:
+        logging.error(errl)
+    except CircuitOpen as errb:
+        logging.info(errb)
     return wind, windGust
 
 def post_WU(outdoor_c, outdoor_dew, outdoor_hum, indoor_press):
@@ -227,8 +483,8 @@ def post_WU(outdoor_c, outdoor_dew, outdoor_hum, indoor_press):
         "action": "updateraw"
     }
     try:
-        responseWU = requests.get(urlWU, params=paramsWU, timeout=5) # WU actually uses GET, not POST
-        responseWU.raise_for_status() # If error, try to catch it in except clauses below
+        breaker_allow("wu")
+        responseWU = breaker_get("wu", urlWU, params=paramsWU, timeout=5) # WU actually uses GET, not POST. If error, try to catch it in except clauses below
         logging.debug(f"Weather Underground response RAW: {responseWU}")
         logging.info(f"Weather Underground status code: {responseWU.status_code}")
         logging.info(f"Weather Underground response text: {responseWU.text}")
@@ -240,6 +496,8 @@ def post_WU(outdoor_c, outdoor_dew, outdoor_hum, indoor_press):
         logging.error(errt)
     except requests.exceptions.RequestException as err:
         logging.error(err)
+    except CircuitOpen as errb:
+        logging.info(errb)
 
 # Indoor BME680 function
 def get_indoor():
@@ -275,26 +533,98 @@ def pi_temp():
         logging.error(f"Failed to read Pi temperature: {e}")
     return temp_c
 
+# Every source polled in the collection phase
+# name: (function, values to use if the source fails or misses the deadline)
+SOURCES = {
+    "outdoor": (get_outdoor, ('U', 'U', 'U', 'U')),
+    "uv": (get_Open_Meteo, 'U'),
+    "owm": (get_OWM, ('U', 'U')),
+    "indoor": (get_indoor, ('U', 'U', 'U', 'U', 'U')),
+    "pi": (pi_temp, 'U')
+}
+
+# Poll the given sources concurrently
+# Cycle latency is bounded by the slowest source (or the deadline) instead of the sum of all of them
+# A source whose call from an earlier tick is still running (hung I2C read, ...) is skipped rather than called again,
+# so hung calls can't pile up, take every worker, or read the same sensor from two threads at once
+source_futures = {} # name: future of its last call
+
+def collect_sources(names):
+    deadline = config.COLLECT_DEADLINE
+    results = {}
+    futures = {}
+    for name in names:
+        previous = source_futures.get(name)
+        if previous and not previous.done():
+            logging.error(f"Source '{name}' is still running from an earlier tick, skipping it. Using 'U'")
+            results[name] = SOURCES[name][1]
+            continue
+        futures[name] = source_futures[name] = executor.submit(SOURCES[name][0])
+    done, not_done = wait(futures.values(), timeout=deadline)
+    for name, future in futures.items():
+        fallback = SOURCES[name][1]
+        if future in not_done:
+            future.cancel() # Only works if it hasn't started yet, otherwise it finishes in the background and is thrown away
+            logging.error(f"Source '{name}' missed the {deadline} second deadline. Using 'U'")
+            results[name] = fallback
+            continue
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            logging.error(f"Source '{name}' failed: {e}. Using 'U'")
+            results[name] = fallback
+    return results
+
+# Every RRD the collector writes to
+RRD_FILES = ["temperatures.rrd", "humidities.rrd", "gas.rrd", "pressures.rrd", "wind.rrd", "uv.rrd"]
+
+# Last update time of each RRD, kept in memory so every update doesn't have to read the RRD header first
+# Loaded once at startup and only re-read from disk after an error
+rrd_last = {}
+
+# When each RRD last got values that differ from the ones before, so graphs are only redrawn when their data moved
+rrd_values = {} # rrd filename: values last written (without the timestamp)
+rrd_changed = {} # rrd filename: epoch of the last update that changed the values
+
+def load_rrd_last(rrd_filename):
+    try:
+        rrd_last[rrd_filename] = rrdtool.last(*rrd_daemon_args(), config.RRD_PATH + rrd_filename) # Through the daemon so queued updates count
+        logging.debug(f"Last update of {rrd_filename}: {rrd_last[rrd_filename]}")
+    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
+        logging.error(f"Couldn't read last update of {rrd_filename}: {err}")
+        rrd_last.pop(rrd_filename, None) # Try again on the next update
+
 def update_rrd(rrd_filename, alignedEpoch, values_string):
     logging.info(f"Updating {rrd_filename}...")
+    if rrd_filename not in rrd_last:
+        load_rrd_last(rrd_filename)
+    last_update = rrd_last.get(rrd_filename, 0)
+    if alignedEpoch <= last_update:
+        logging.warning(f"Skipped update for {rrd_filename}: timestamp {alignedEpoch} <= last update {last_update}")
+        return
     try:
-        last_update = rrdtool.last(config.RRD_PATH + rrd_filename)
-        if alignedEpoch > last_update:
+        if config.RRDCACHED:
+            rrdtool.update(*rrd_daemon_args(), config.RRD_PATH + rrd_filename, values_string) # rrdcached doesn't do verbose updates
+        else:
             result = rrdtool.updatev(config.RRD_PATH + rrd_filename, values_string)
             logging.debug(f"Full result from rrdtool.updatev: {result}")
-            logging.info(f"Updated {rrd_filename} with values {values_string}") #Show what went into the RRD
-        else:
-            logging.warning(f"Skipped update for {rrd_filename}: timestamp {alignedEpoch} <= last update {last_update}")
-            return
+        rrd_last[rrd_filename] = alignedEpoch
+        logging.info(f"Updated {rrd_filename} with values {values_string}") #Show what went into the RRD
+        values = values_string.split(":", 1)[1]
+        if rrd_values.get(rrd_filename) != values:
+            rrd_values[rrd_filename] = values
+            rrd_changed[rrd_filename] = alignedEpoch
     except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
         logging.error(f"Error updating {rrd_filename}: {err}")
-        logging.error(f"Fail! Result: {result}")
+        load_rrd_last(rrd_filename) # Our copy might be out of date (file replaced, updated by someone else), re-read it
 
 def update_uv(epoch):
     # Only update UV every 30 minutes because of API rate limits
     alignedEpoch = epoch - (epoch % 1800)  # 30-minute alignment for UV
     logging.debug(f"30 minute aligned epoch time: {alignedEpoch}")
-    last_uv_update = rrdtool.last(config.RRD_PATH + "uv.rrd")
+    if "uv.rrd" not in rrd_last:
+        load_rrd_last("uv.rrd")
+    last_uv_update = rrd_last.get("uv.rrd", 0)
     logging.debug(f"Last UV update time: {last_uv_update}")
     if alignedEpoch > last_uv_update:
         outdoorUV = get_OpenUV_Index()
@@ -304,263 +634,85 @@ def update_uv(epoch):
         outdoorUV = 'U'  # Set to NaN if update is skipped
     return outdoorUV
 
-def create_graphs():
-    logging.info("Creating graphs...")
-
-    # Reduce duplicate lines of code
-    common_args = [
-        "--end", "now", "--start", "end-2880m", "--step", "120",
-        "--width", "1440",
-        "--font", "DEFAULT:10:",
-        "--font", "AXIS:8:",
-        "--x-grid","MINUTE:30:HOUR:1:HOUR:2:0:%H:00",
-        "--alt-autoscale",
-        "--border", "0",
-        "--slope-mode",
-        "-c", "BACK#333333",
-        "-c", "CANVAS#18191A",
-        "-c", "FONT#DDDDDD",
-        "-c", "GRID#DDDDDD1A",
-        "-c", "MGRID#DDDDDD33",
-        "-c", "FRAME#18191A",
-        "-c", "ARROW#333333",
-        "--disable-rrdtool-tag"
-    ]
+# Renderer processes leave shutting down to the collector
+def renderer_process_init():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
-    try:
-        result = rrdtool.graph("/mnt/tmp/temperatures.png",
-            common_args,
-            "--title", "Temperature",
-            "--vertical-label", "Celsius",
-            "--right-axis-label", "Fahrenheit",
-            "--right-axis", "1.8:32",
-            "--height", "380",
-            "DEF:outdoor=./rrd/temperatures.rrd:outdoor:LAST",
-            "DEF:indoor=./rrd/temperatures.rrd:indoor:LAST",
-            "DEF:outdoor_dew=./rrd/temperatures.rrd:outdoor_dew:LAST",
-            "DEF:indoor_dew=./rrd/temperatures.rrd:indoor_dew:LAST",
-            "DEF:outdoorMax=./rrd/temperatures.rrd:outdoor:MAX",
-            "DEF:indoorMax=./rrd/temperatures.rrd:indoor:MAX",
-            "DEF:outdoor_dewMax=./rrd/temperatures.rrd:outdoor_dew:MAX",
-            "DEF:indoor_dewMax=./rrd/temperatures.rrd:indoor_dew:MAX",
-            "DEF:outdoorMin=./rrd/temperatures.rrd:outdoor:MIN",
-            "DEF:indoorMin=./rrd/temperatures.rrd:indoor:MIN",
-            "DEF:outdoor_dewMin=./rrd/temperatures.rrd:outdoor_dew:MIN",
-            "DEF:indoor_dewMin=./rrd/temperatures.rrd:indoor_dew:MIN",
-            "CDEF:outdoor-f=outdoor,1.8,*,32,+",
-            "CDEF:indoor-f=indoor,1.8,*,32,+",
-            "CDEF:outdoor_dew-f=outdoor_dew,1.8,*,32,+",
-            "CDEF:indoor_dew-f=indoor_dew,1.8,*,32,+",
-            "CDEF:outdoorMax-f=outdoorMax,1.8,*,32,+",
-            "CDEF:indoorMax-f=indoorMax,1.8,*,32,+",
-            "CDEF:outdoor_dewMax-f=outdoor_dewMax,1.8,*,32,+",
-            "CDEF:indoor_dewMax-f=indoor_dewMax,1.8,*,32,+",
-            "CDEF:outdoorMin-f=outdoorMin,1.8,*,32,+",
-            "CDEF:indoorMin-f=indoorMin,1.8,*,32,+",
-            "CDEF:outdoor_dewMin-f=outdoor_dewMin,1.8,*,32,+",
-            "CDEF:indoor_dewMin-f=indoor_dewMin,1.8,*,32,+",
-            "LINE1:outdoor#ff0000:Outdoor         ",
-            "GPRINT:outdoor:LAST:Cur\: %5.2lf °C",
-            "GPRINT:outdoor-f:LAST: %5.1lf °F",
-            "GPRINT:outdoorMax:MAX:Max\: %5.2lf °C",
-            "GPRINT:outdoorMax-f:MAX: %5.1lf °F",
-            "GPRINT:outdoorMin:MIN:Min\: %5.2lf °C",
-            "GPRINT:outdoorMin-f:MIN: %5.1lf °F\l",
-            "LINE1:outdoor_dew#ff00ff:Outdoor Dewpoint",
-            "GPRINT:outdoor_dew:LAST:Cur\: %5.2lf °C",
-            "GPRINT:outdoor_dew-f:LAST: %5.1lf °F",
-            "GPRINT:outdoor_dewMax:MAX:Max\: %5.2lf °C",
-            "GPRINT:outdoor_dewMax-f:MAX: %5.1lf °F",
-            "GPRINT:outdoor_dewMin:MIN:Min\: %5.2lf °C",
-            "GPRINT:outdoor_dewMin-f:MIN: %5.1lf °F\l",
-            "LINE1:indoor#0000ff:Indoor          ",
-            "GPRINT:indoor:LAST:Cur\: %5.2lf °C",
-            "GPRINT:indoor-f:LAST: %5.1lf °F",
-            "GPRINT:indoorMax:MAX:Max\: %5.2lf °C",
-            "GPRINT:indoorMax-f:MAX: %5.1lf °F",
-            "GPRINT:indoorMin:MIN:Min\: %5.2lf °C",
-            "GPRINT:indoorMin-f:MIN: %5.1lf °F\l",
-            "LINE1:indoor_dew#00ffff:Indoor Dewpoint ",
-            "GPRINT:indoor_dew:LAST:Cur\: %5.2lf °C",
-            "GPRINT:indoor_dew-f:LAST: %5.1lf °F",
-            "GPRINT:indoor_dewMax:MAX:Max\: %5.2lf °C",
-            "GPRINT:indoor_dewMax-f:MAX: %5.1lf °F",
-            "GPRINT:indoor_dewMin:MIN:Min\: %5.2lf °C",
-            "GPRINT:indoor_dewMin-f:MIN: %5.1lf °F\l"
-        )
-    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
-        logging.error(f"Error creating graph: {err}")
-        logging.error(f"Fail! Result: {result}")
-    else:
-        logging.info(f"Success! Width: {result[0]} Height: {result[1]} Extra Info: {result[2]}")
+# Graphs that need redrawing: one of their RRDs got new values since the last time they were drawn
+# and the graph's range is due (a year long graph only every so often, see graphs.RANGES),
+# or they're older than config.GRAPH_MAX_AGE (the time axis still moves even if the data doesn't)
+graph_drawn = {} # graph name: (time.time() when drawn, newest rrd_changed epoch of its RRDs at that point)
 
-    try:
-        result = rrdtool.graph("/mnt/tmp/humidities.png",
-            common_args,
-            "--title", "Humidity",
-            "--vertical-label", "Relative (%)",
-            "--right-axis-label", "Relative (%)",
-            "--right-axis", "1:0",
-            "--height", "300",
-            "DEF:outdoor=./rrd/humidities.rrd:outdoor:LAST",
-            "DEF:indoor=./rrd/humidities.rrd:indoor:LAST",
-            "VDEF:outdoorMax=outdoor,MAXIMUM",
-            "VDEF:outdoorMin=outdoor,MINIMUM",
-            "VDEF:indoorMax=indoor,MAXIMUM",
-            "VDEF:indoorMin=indoor,MINIMUM",
-            "LINE1:outdoor#ff0000:Outdoor",
-            "GPRINT:outdoor:LAST:Cur\: %.1lf%%",
-            "GPRINT:outdoorMax:Max\: %.1lf%%",
-            "GPRINT:outdoorMin:Min\: %.1lf%%\l",
-            "LINE1:indoor#0000ff:Indoor ",
-            "GPRINT:indoor:LAST:Cur\: %.1lf%%",
-            "GPRINT:indoorMax:Max\: %.1lf%%",
-            "GPRINT:indoorMin:Min\: %.1lf%%\l"
-        )
-    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
-        logging.error(f"Error creating graph: {err}")
-        logging.error(f"Fail! Result: {result}")
-    else:
-        logging.info(f"Success! Width: {result[0]} Height: {result[1]} Extra Info: {result[2]}")
+def changed_graphs():
+    changed = {}
+    for name, args in graph_definitions().items():
+        newest = max(rrd_changed.get(os.path.basename(rrd), 0) for rrd in graph_sources(args))
+        drawn = graph_drawn.get(name)
+        if drawn is None:
+            changed[name] = newest
+            continue
+        age = time.time() - drawn[0]
+        interval = graph_interval(name)
+        if (newest > drawn[1] and age >= interval) or age > max(config.GRAPH_MAX_AGE, interval):
+            changed[name] = newest
+    return changed
 
-    try:
-        result = rrdtool.graph("/mnt/tmp/pressures.png",
-            common_args,
-            "--title", "Barometric Pressure (MSL)",
-            "--vertical-label", "hPa",
-            "--right-axis-label", "hPa",
-            "--right-axis", "1:0", "--right-axis-format", "%4.0lf",
-            "--height", "300",
-            "--lower-limit", "998", "--upper-limit", "1018",
-            "--y-grid", "1:2",
-            "--units-exponent", "0",
-            "DEF:indoor=./rrd/pressures.rrd:indoor:LAST",
-            "VDEF:indoorMax=indoor,MAXIMUM",
-            "VDEF:indoorMin=indoor,MINIMUM",
-            "LINE1:indoor#00ff00:Local",
-            "GPRINT:indoor:LAST:Cur\: %.2lf hPa",
-            "GPRINT:indoorMax:Max\: %.2lf hPa",
-            "GPRINT:indoorMin:Min\: %.2lf hPa\l"
-        )
-    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
-        logging.error(f"Error creating graph: {err}")
-        logging.error(f"Fail! Result: {result}")
-    else:
-        logging.info(f"Success! Width: {result[0]} Height: {result[1]} Extra Info: {result[2]}")
+def mark_graphs_drawn(changed):
+    drawn = time.time()
+    for name, newest in changed.items():
+        graph_drawn[name] = (drawn, newest)
 
-    try:
-        result = rrdtool.graph("/mnt/tmp/gas.png",
-            common_args,
-            "--title", "Gas Resistance",
-            "--vertical-label", "Ω",
-            "--right-axis-label", "Ω",
-            "--right-axis", "1:0",
-            "--height", "250",
-            "DEF:indoor=./rrd/gas.rrd:indoor:LAST",
-            "VDEF:indoorMax=indoor,MAXIMUM",
-            "VDEF:indoorMin=indoor,MINIMUM",
-            "LINE1:indoor#0000ff:Indoor",
-            "GPRINT:indoor:LAST:Cur\: %.1lf%s Ω",
-            "GPRINT:indoorMax:Max\: %.1lf%s Ω",
-            "GPRINT:indoorMin:Min\: %.1lf%s Ω\l"
-        )
-    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
-        logging.error(f"Error creating graph: {err}")
-        logging.error(f"Fail! Result: {result}")
-    else:
-        logging.info(f"Success! Width: {result[0]} Height: {result[1]} Extra Info: {result[2]}")
+# Render the given graphs, returns the names of the ones that rendered successfully
+def create_graphs(names):
+    logging.info(f"Creating graphs: {', '.join(names)}")
+    started = time.monotonic()
+    definitions = graph_definitions()
+    jobs = [(config.GRAPH_PATH + name + ".png", definitions[name]) for name in names]
+    rendered = []
+    for name, (path, seconds, result, err) in zip(names, renderer_pool.starmap(render_graph, jobs)): # Graphs render in parallel, one per core
+        if err:
+            logging.error(f"Error creating graph {path}: {err}")
+        else:
+            rendered.append(name)
+            logging.info(f"Rendered {path} in {seconds:.2f} seconds. Width: {result[0]} Height: {result[1]} Extra Info: {result[2]}")
+    logging.info(f"Done creating graphs in {time.monotonic() - started:.2f} seconds")
+    return rendered
 
-    try:
-        result = rrdtool.graph("/mnt/tmp/wind.png",
-            common_args,
-            "--title", "Wind Speeds",
-            "--vertical-label", "Miles Per Hour",
-            "--right-axis-label", "Miles Per Hour",
-            "--right-axis", "1:0",
-            "--height", "250",
-            "DEF:outdoor_wind=./rrd/wind.rrd:outdoor_wind:LAST",
-            "DEF:outdoor_windGust=./rrd/wind.rrd:outdoor_windGust:LAST",
-            "VDEF:outdoor_windMax=outdoor_wind,MAXIMUM",
-            "VDEF:outdoor_windMin=outdoor_wind,MINIMUM",
-            "VDEF:outdoor_windGustMax=outdoor_windGust,MAXIMUM",
-            "VDEF:outdoor_windGustMin=outdoor_windGust,MINIMUM",
-            "LINE1:outdoor_wind#0000ff:Wind",
-            "GPRINT:outdoor_wind:LAST:Cur\: %.1lf",
-            "GPRINT:outdoor_windMax:Max\: %.1lf",
-            "GPRINT:outdoor_windMin:Min\: %.1lf\l",
-            "LINE1:outdoor_windGust#ff0000:Gust ",
-            "GPRINT:outdoor_windGust:LAST:Cur\: %.1lf",
-            "GPRINT:outdoor_windGustMax:Max\: %.1lf",
-            "GPRINT:outdoor_windGustMin:Min\: %.1lf\l"
-        )
-    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
-        logging.error(f"Error creating graph: {err}")
-        logging.error(f"Fail! Result: {result}")
-    else:
-        logging.info(f"Success! Width: {result[0]} Height: {result[1]} Extra Info: {result[2]}")
+# Graph rendering runs in its own thread (and a pool of renderer processes) so it never blocks collection
+# There's at most one render running and one waiting. A new request while one is waiting just replaces it
+render_requested = threading.Condition()
+render_pending = False
+render_reading = None # Reading to send along with the images once they're rendered
 
-    try:
-        result = rrdtool.graph("/mnt/tmp/uv.png",
-            common_args,
-            "--title", "UV Index",
-            "--vertical-label", "Index",
-            "--right-axis-label", "Index",
-            "--right-axis", "1:0",
-            "--height", "250",
-            "DEF:outdoor=./rrd/uv.rrd:outdoor:LAST",
-            "VDEF:outdoorMax=outdoor,MAXIMUM",
-            "LINE1:outdoor#ffa500:Outdoor",
-            "GPRINT:outdoor:LAST:Cur\: %.1lf",
-            "GPRINT:outdoorMax:Max\: %.1lf\l"
-        )
-    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
-        logging.error(f"Error creating graph: {err}")
-        logging.error(f"Fail! Result: {result}")
-    else:
-        logging.info(f"Success! Width: {result[0]} Height: {result[1]} Extra Info: {result[2]}")
+def request_render(reading):
+    global render_pending, render_reading
+    with render_requested:
+        if render_pending:
+            logging.info("Render already queued, replacing it with this one")
+        render_pending = True
+        render_reading = reading
+        render_requested.notify()
 
-    try:
-        result = rrdtool.graph("/mnt/tmp/pi.png",
-            common_args,
-            "--title", "Pi Temperatures",
-            "--vertical-label", "Celsius",
-            "--right-axis-label", "Fahrenheit",
-            "--right-axis", "1.8:32",
-            "--height", "150",
-            "DEF:pi=./rrd/temperatures.rrd:pi:LAST",
-            "DEF:picow=./rrd/temperatures.rrd:picow:LAST",
-            "DEF:piMax=./rrd/temperatures.rrd:pi:MAX",
-            "DEF:picowMax=./rrd/temperatures.rrd:picow:MAX",
-            "DEF:piMin=./rrd/temperatures.rrd:pi:MIN",
-            "DEF:picowMin=./rrd/temperatures.rrd:picow:MIN",
-            "CDEF:pi-f=pi,1.8,*,32,+",
-            "CDEF:picow-f=picow,1.8,*,32,+",
-            "CDEF:piMax-f=piMax,1.8,*,32,+",
-            "CDEF:piMin-f=piMin,1.8,*,32,+",
-            "CDEF:picowMax-f=picowMax,1.8,*,32,+",
-            "CDEF:picowMin-f=picowMin,1.8,*,32,+",
-            "LINE1:picow#ff0000:Pico W MCU",
-            "GPRINT:picow:LAST:Cur\: %5.2lf °C",
-            "GPRINT:picow-f:LAST: %5.1lf °F",
-            "GPRINT:picowMax:MAX:Max\: %5.2lf °C",
-            "GPRINT:picowMax-f:MAX: %5.1lf °F",
-            "GPRINT:picowMin:MIN:Min\: %5.2lf °C",
-            "GPRINT:picowMin-f:MIN: %5.1lf °F\l",
-            "LINE1:pi#0000ff:Zero W CPU",
-            "GPRINT:pi:LAST:Cur\: %5.2lf °C",
-            "GPRINT:pi-f:LAST: %5.1lf °F",
-            "GPRINT:piMax:MAX:Max\: %5.2lf °C",
-            "GPRINT:piMax-f:MAX: %5.1lf °F",
-            "GPRINT:piMin:MIN:Min\: %5.2lf °C",
-            "GPRINT:piMin-f:MIN: %5.1lf °F\l"
-        )
-    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
-        logging.error(f"Error creating graph: {err}")
-        logging.error(f"Fail! Result: {result}")
-    else:
-        logging.info(f"Success! Width: {result[0]} Height: {result[1]} Extra Info: {result[2]}")
-
-    logging.info("Done creating graphs")
+def renderer():
+    global render_pending
+    while True:
+        with render_requested:
+            while not render_pending:
+                render_requested.wait()
+            render_pending = False
+            reading = render_reading
+        try:
+            changed = changed_graphs()
+            rendered = []
+            if changed:
+                rendered = create_graphs(list(changed))
+                mark_graphs_drawn({name: changed[name] for name in rendered})
+            else:
+                logging.info("No graph has new data, nothing to render")
+            notify_flask(rendered, reading)
+        except Exception as e:
+            logging.exception(f"Renderer failed: {e}")
 
 # Updates the SQLite database with the provided data
 def update_sqlite_database(started, epoch, outdoor_c, outdoor_dew, outdoor_hum, indoor_c, indoor_dew, indoor_hum, indoor_press, outdoorUV, outdoor_wind, outdoor_windGust, indoor_gas, pi_temp_c, picow_temp_c):
@@ -568,19 +720,95 @@ def update_sqlite_database(started, epoch, outdoor_c, outdoor_dew, outdoor_hum,
         logging.info(f"Updating SQLite database")
         #epoch = round(started.timestamp()) # convert datetime to unix epoch time before INSERT, instead of during INSERT, in the SCHEMA or in SELECT later on
         logging.debug(f"Epoch time: {epoch}")
-        cursor.execute(
-            "INSERT INTO data VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (started, epoch, outdoor_c, outdoor_dew, outdoor_hum, indoor_c, indoor_dew, indoor_hum, indoor_press, outdoorUV, outdoor_wind, outdoor_windGust, indoor_gas, pi_temp_c, picow_temp_c)
-        )
-        connection.commit()
-        logging.info(f"SQLite database updated successfully.")
+        values = (outdoor_c, outdoor_dew, outdoor_hum, indoor_c, indoor_dew, indoor_hum, indoor_press, outdoorUV, outdoor_wind, outdoor_windGust, indoor_gas, pi_temp_c, picow_temp_c)
+        if compact_schema:
+            cursor.execute(INSERT_SAMPLE, encode_row(epoch, values)) # started is derived from epoch by the data view
+        else:
+            cursor.execute("INSERT INTO data VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (started, epoch, *values))
+        update_rollups(epoch, values) # Same transaction as the row
+        commit_sqlite_database()
     except sqlite3.Error as e:
         logging.error(f"Error updating SQLite database: {e}")
 
+# Hourly and daily rollups (min, max, sum, count per metric) kept up to date on every insert
+# so high/low stats never have to scan the data table. Metric names match freyrFlask.py's /api fields
+ROLLUP_METRICS = ["outdoorTemp", "outdoorDewpoint", "outdoorHumidity", "indoorTemp", "indoorDewpoint", "indoorHumidity",
+    "localPressure", "uv", "wind", "windGust", "indoorGas", "piTemp", "picowTemp"] # Same order as the data table's columns after epoch
+ROLLUP_TABLES = ["rollup_hourly", "rollup_daily"]
+
+# Start of the hour / local day an epoch falls in
+def rollup_buckets(epoch):
+    day = datetime.fromtimestamp(epoch).replace(hour=0, minute=0, second=0, microsecond=0)
+    return {"rollup_hourly": epoch - (epoch % 3600), "rollup_daily": int(day.timestamp())}
+
+def create_rollups():
+    for table in ROLLUP_TABLES:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (bucket INTEGER, metric TEXT, min REAL, max REAL, sum REAL, count INTEGER, PRIMARY KEY (bucket, metric)) WITHOUT ROWID")
+    if cursor.execute("SELECT 1 FROM rollup_daily LIMIT 1").fetchone():
+        return
+    # New tables, fill them in from what's already in the data table. Only ever happens once
+    logging.warning("Building rollup tables from existing data, this can take a while...")
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(data)").fetchall()]
+    epoch = columns[1]
+    buckets = {
+        "rollup_hourly": f'"{epoch}" - ("{epoch}" % 3600)',
+        "rollup_daily": f"""CAST(strftime('%s', "{epoch}", 'unixepoch', 'localtime', 'start of day', 'utc') AS INTEGER)"""
+    }
+    for metric, column in zip(ROLLUP_METRICS, columns[2:]):
+        for table, bucket in buckets.items():
+            cursor.execute(f"""INSERT INTO {table} SELECT {bucket}, ?, MIN("{column}"), MAX("{column}"), SUM("{column}"), COUNT("{column}")
+                FROM data WHERE typeof("{column}") IN ('real', 'integer') GROUP BY 1""", (metric,))
+    logging.warning("Done building rollup tables")
+
+def update_rollups(epoch, values):
+    buckets = rollup_buckets(epoch)
+    for metric, value in zip(ROLLUP_METRICS, values):
+        if value == 'U': # No data
+            continue
+        for table in ROLLUP_TABLES:
+            cursor.execute(
+                f"""INSERT INTO {table} VALUES (?, ?, ?, ?, ?, 1)
+                ON CONFLICT (bucket, metric) DO UPDATE SET min = min(min, excluded.min), max = max(max, excluded.max), sum = sum + excluded.sum, count = count + 1""",
+                (buckets[table], metric, value, value, value)
+            )
+
+# Group commit: rows are committed every config.SQLITE_COMMIT_ROWS rows or config.SQLITE_COMMIT_SECONDS seconds,
+# whichever comes first, so there's one fsync per batch instead of one per row. SQLITE_COMMIT_SECONDS of 0 or None only counts rows
+# force=True commits whatever is pending (on exit)
+pending_rows = 0
+last_commit = time.monotonic()
+
+def commit_sqlite_database(force=False):
+    global pending_rows, last_commit
+    if not force:
+        pending_rows += 1
+        overdue = config.SQLITE_COMMIT_SECONDS and time.monotonic() - last_commit >= config.SQLITE_COMMIT_SECONDS # 0/None: no time limit
+        if pending_rows < config.SQLITE_COMMIT_ROWS and not overdue:
+            logging.info(f"SQLite row queued, {pending_rows} waiting to be committed")
+            return
+    if pending_rows:
+        connection.commit()
+        logging.info(f"SQLite database updated successfully. Committed {pending_rows} row(s)")
+    pending_rows = 0
+    last_commit = time.monotonic()
+
+# Log how well the shared HTTP session is reusing connections
+# reused = requests sent - connections opened, per host
+def log_http_pool_stats():
+    pools = session.get_adapter("https://").poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None: # Evicted between keys() and get()
+            continue
+        reused = pool.num_requests - pool.num_connections
+        logging.info(f"HTTP pool {pool.scheme}://{pool.host}:{pool.port} - connections: {pool.num_connections} requests: {pool.num_requests} reused: {reused}")
+
 # Inter-process communication with 'freyrFlask.py'
-def notify_flask():
+# 'images' are the graph names that changed, so browsers only reload those
+# 'reading' is the latest value of everything (see current_reading()), pushed to clients so they don't have to poll /api
+def notify_flask(images, reading):
     try:
-        responseFlask = requests.post("http://127.0.0.1:5000/notify", timeout=5)
+        responseFlask = session.post("http://127.0.0.1:5000/notify", json={"images": images, "reading": reading}, timeout=5)
         responseFlask.raise_for_status()  # Raise an error for bad responses
         # Code below here will only run if the request is successful
         logging.info(f"Flask notified: {responseFlask.status_code} - {responseFlask.text}")
@@ -595,59 +823,238 @@ def notify_flask():
     except Exception as e:
         logging.error(f"Failed to notify Flask: {e}")
 
+# Latest values from each source
+# name: (values, time.time() when they were sampled)
+readings = {}
+
+# Scheduling
+# Each job runs every 'interval' seconds on boundaries aligned to the epoch, plus 'offset' seconds
+# Alignment is worked out on the wall clock, but waiting is done on the monotonic clock so ticks don't drift
+def next_due(name, after):
+    interval, offset = config.SCHEDULE[name]
+    return after - ((after - offset) % interval) + interval
+
+# Difference between the wall clock and the monotonic clock, wall = monotonic + clock_offset
+def wall_clock_offset():
+    return time.time() - time.monotonic()
+
+# Build the queue from scratch, every job at its next aligned boundary on the monotonic clock
+def build_queue():
+    global clock_offset
+    clock_offset = wall_clock_offset()
+    now = time.time()
+    queue = [] # Priority queue of (next due time (monotonic), job name)
+    for name in config.SCHEDULE:
+        heapq.heappush(queue, (next_due(name, now) - clock_offset, name))
+    return queue
+
+# Work out when a job runs next after the tick that was due at 'due' (monotonic)
+# Adding the interval to the previous due time (not to 'now') keeps ticks on their aligned boundaries
+# When a tick ran so late that the next one is already in the past, config.OVERRUN_POLICY decides:
+#   'skip'    - drop the missed ticks and carry on at the next aligned boundary
+#   'catchup' - run the missed ticks back to back until we're caught up
+#   'shift'   - run again one interval from now, giving up alignment
+def reschedule(name, due, now):
+    interval = config.SCHEDULE[name][0]
+    next_time = due + interval
+    if next_time > now or config.OVERRUN_POLICY == "catchup":
+        return next_time
+    if config.OVERRUN_POLICY == "shift":
+        logging.warning(f"Job '{name}' overran, shifting schedule by {now - due:.2f} seconds")
+        return now + interval
+    missed = int((now - due) // interval)
+    logging.warning(f"Job '{name}' overran, skipping {missed} tick(s)")
+    return due + (missed + 1) * interval
+
+# Latest values from a source, or 'U' if it hasn't been sampled recently
+# Anything older than 2 source intervals is considered stale
+def latest(name):
+    function, fallback = SOURCES[name]
+    if name not in readings:
+        return fallback
+    values, sampled = readings[name]
+    if time.time() - sampled > 2 * config.SCHEDULE[name][0]:
+        logging.warning(f"Reading from '{name}' is stale. Using 'U'")
+        return fallback
+    return values
+
+def sink_rrd(epoch):
+    alignedEpoch = epoch - (epoch % 60) # Align to 60 second intervals
+    logging.debug(f"60 second aligned epoch time: {alignedEpoch}")
+    outdoor_c, outdoor_hum, outdoor_dew, picow_temp_c = latest("outdoor")
+    outdoorUV = latest("uv")
+    outdoor_wind, outdoor_windGust = latest("owm")
+    indoor_c, indoor_hum, indoor_dew, indoor_press, indoor_gas = latest("indoor")
+    pi_temp_c = latest("pi")
+    logging.info("Updating RRD databases...")
+    update_rrd("temperatures.rrd", alignedEpoch, f"{alignedEpoch}:{outdoor_c}:{indoor_c}:{pi_temp_c}:{picow_temp_c}:{outdoor_dew}:{indoor_dew}")
+    update_rrd("humidities.rrd", alignedEpoch, f"{alignedEpoch}:{outdoor_hum}:{indoor_hum}")
+    update_rrd("gas.rrd", alignedEpoch, f"{alignedEpoch}:{indoor_gas}")
+    update_rrd("pressures.rrd", alignedEpoch, f"{alignedEpoch}:{indoor_press}")
+    update_rrd("wind.rrd", alignedEpoch, f"{alignedEpoch}:{outdoor_wind}:{outdoor_windGust}")
+    update_rrd("uv.rrd", alignedEpoch, f"{alignedEpoch}:{outdoorUV}")
+
+def sink_sqlite(epoch):
+    outdoor_c, outdoor_hum, outdoor_dew, picow_temp_c = latest("outdoor")
+    outdoorUV = latest("uv")
+    outdoor_wind, outdoor_windGust = latest("owm")
+    indoor_c, indoor_hum, indoor_dew, indoor_press, indoor_gas = latest("indoor")
+    pi_temp_c = latest("pi")
+    started = datetime.fromtimestamp(epoch)
+    update_sqlite_database(started, epoch, outdoor_c, outdoor_dew, outdoor_hum, indoor_c, indoor_dew, indoor_hum, indoor_press, outdoorUV, outdoor_wind, outdoor_windGust, indoor_gas, pi_temp_c, picow_temp_c)
+    if config.BINARY_STORE:
+        update_binary_store(epoch, (outdoor_c, outdoor_dew, outdoor_hum, indoor_c, indoor_dew, indoor_hum, indoor_press, outdoorUV, outdoor_wind, outdoor_windGust, indoor_gas, pi_temp_c, picow_temp_c))
+
+# Optional fixed-record store next to SQLite (see binstore.py)
+# Opened on the first write, so a new store starts at that minute
+binary_store = None
+
+def update_binary_store(epoch, values):
+    global binary_store
+    try:
+        if binary_store is None:
+            binary_store = binstore.open_for_append(config.BINARY_STORE, epoch)
+        binstore.append(binary_store, epoch, values)
+        logging.info("Binary store updated")
+    except (OSError, ValueError) as e:
+        logging.error(f"Error updating binary store: {e}")
+
+def sink_wu(epoch):
+    outdoor_c, outdoor_hum, outdoor_dew, picow_temp_c = latest("outdoor")
+    indoor_press = latest("indoor")[3]
+    if 'U' in (outdoor_c, outdoor_hum, outdoor_dew, indoor_press):
+        logging.warning("Missing data, skipping Weather Underground post")
+        return
+    post_WU(outdoor_c, outdoor_dew, outdoor_hum, indoor_press) # Post to Weather Underground
+
+# Moves months older than config.SQLITE_ARCHIVE_MONTHS into their own archive files (see sqlite_schema.py)
+# so freyr.db, and every query and VACUUM on it, stays the same size however many years are recorded
+# Only does any work on the first run after a month ends
+def sink_archive(epoch):
+    commit_sqlite_database(force=True) # ATTACH can't happen inside an open transaction
+    for path, rows in archive(connection, config.SQLITE_ARCHIVE_MONTHS):
+        logging.warning(f"Archived {rows} rows to {path}")
+
+# Latest values from every source, same keys as freyrFlask.py's /api, None for no data
+def current_reading(epoch):
+    outdoor_c, outdoor_hum, outdoor_dew, picow_temp_c = latest("outdoor")
+    outdoorUV = latest("uv")
+    outdoor_wind, outdoor_windGust = latest("owm")
+    indoor_c, indoor_hum, indoor_dew, indoor_press, indoor_gas = latest("indoor")
+    pi_temp_c = latest("pi")
+    reading = {
+        "time": str(datetime.fromtimestamp(epoch)),
+        "epoch": epoch,
+        "outdoorTemp": outdoor_c,
+        "outdoorDewpoint": outdoor_dew,
+        "outdoorHumidity": outdoor_hum,
+        "indoorTemp": indoor_c,
+        "indoorDewpoint": indoor_dew,
+        "indoorHumidity": indoor_hum,
+        "localPressure": indoor_press,
+        "uv": outdoorUV,
+        "wind": outdoor_wind,
+        "windGust": outdoor_windGust,
+        "indoorGas": indoor_gas,
+        "piTemp": pi_temp_c,
+        "picowTemp": picow_temp_c
+    }
+    return {key: None if value == 'U' else value for key, value in reading.items()}
+
+def sink_graphs(epoch):
+    reading = current_reading(epoch)
+    if config.GRAPHS_ON_DEMAND:
+        # freyrFlask.py renders graphs when they're asked for, just tell browsers which ones have new data
+        changed = changed_graphs()
+        mark_graphs_drawn(changed)
+        notify_flask(list(changed), reading)
+    else:
+        request_render(reading) # Rendering happens in the renderer thread, collection carries on
+
+# Every sink, in the order they run when they are due at the same time
+SINKS = {
+    "rrd": sink_rrd,
+    "sqlite": sink_sqlite,
+    "wu": sink_wu,
+    "graphs": sink_graphs,
+    "archive": sink_archive
+}
+
+# Run every job that is due at this tick
+# Sources go first (concurrently) so the sinks due at the same time write the freshest values
+def run_tick(jobs, epoch):
+    started = time.monotonic() # Start timing the operation
+    logging.info(f"~~~~~~~~~~~~~~new tick: {', '.join(jobs)}~~~~~~~~~~~~~~~~") # Start logging cycle with a row of tildes to differentiate
+    logging.debug(f"Epoch time: {epoch}")
+    sources = [name for name in jobs if name in SOURCES]
+    if sources:
+        results = collect_sources(sources)
+        sampled = time.time()
+        for name, values in results.items():
+            readings[name] = (values, sampled)
+    for name in SINKS:
+        if name in jobs:
+            try:
+                SINKS[name](epoch)
+            except Exception as e:
+                logging.exception(f"Sink '{name}' failed: {e}")
+    if "graphs" in jobs:
+        log_http_pool_stats()
+        log_breaker_status()
+    logging.info(f"Tick took {time.monotonic() - started:.2f} seconds")
+
 def graceful_exit(signal_number, stack_frame):
     signal_name = signal.Signals(signal_number).name
     logging.warning(f"Received signal {signal_name} to exit. Cleaning up...")
-    # Close the SQLite connection
+    # Commit anything still waiting and close the SQLite connection
     if connection:
+        try:
+            commit_sqlite_database(force=True)
+        except sqlite3.Error as e:
+            logging.error(f"Error committing SQLite database on exit: {e}")
         connection.close()
         logging.warning(f"Closed connection to SQLite database")
+    if binary_store:
+        binary_store[0].close()
+    # Stop the renderer processes, a half rendered graph is simply rendered again next time
+    if renderer_pool:
+        renderer_pool.terminate()
+        logging.warning("Stopped renderer processes")
     logging.warning("Exiting freyr...")
     sys.exit(0)
 
 def main():
-    logging.info("Starting main while loop")
-    # Loop parameters
-    interval = config.LOOP_INTERVAL
-    interval = timedelta(seconds=interval) # Convert integer into proper time format
+    logging.info("Starting scheduler")
+    # Poll every source right away so the sinks have something to write before the sources' first aligned tick
+    for name, values in collect_sources(SOURCES).items():
+        readings[name] = (values, time.time())
+    queue = build_queue()
+    last_lateness = 0.0
     while True: # main while loop that should run forever
-        started = datetime.now() # Start timing the operation
-        logging.info("~~~~~~~~~~~~~~new cycle~~~~~~~~~~~~~~~~") # Start logging cycle with a row of tildes to differentiate
-        logging.debug(f"Loop started at {started}")
-        epoch = int(started.timestamp()) # truncate with int() instead of round() for time-alignment below
-        logging.debug(f"Epoch time: {epoch}")
-        alignedEpoch = epoch - (epoch % 60) # Align to 60 second intervals
-        logging.debug(f"60 second aligned epoch time: {alignedEpoch}")
-        outdoor_c, outdoor_hum, outdoor_dew, picow_temp_c = get_outdoor()
-        outdoorUV = get_Open_Meteo()
-        outdoor_wind, outdoor_windGust = get_OWM()
-        indoor_c, indoor_hum, indoor_dew, indoor_press, indoor_gas = get_indoor()
-        pi_temp_c = pi_temp()
-        logging.info("Updating databases...")
-        update_rrd("temperatures.rrd", alignedEpoch, f"{alignedEpoch}:{outdoor_c}:{indoor_c}:{pi_temp_c}:{picow_temp_c}:{outdoor_dew}:{indoor_dew}")
-        update_rrd("humidities.rrd", alignedEpoch, f"{alignedEpoch}:{outdoor_hum}:{indoor_hum}")
-        update_rrd("gas.rrd", alignedEpoch, f"{alignedEpoch}:{indoor_gas}")
-        update_rrd("pressures.rrd", alignedEpoch, f"{alignedEpoch}:{indoor_press}")
-        update_rrd("wind.rrd", alignedEpoch, f"{alignedEpoch}:{outdoor_wind}:{outdoor_windGust}")
-        update_rrd("uv.rrd", alignedEpoch, f"{alignedEpoch}:{outdoorUV}")
-        #outdoorUV = update_uv(epoch) # Only update UV every 30 minutes because of API rate limits
-
-        update_sqlite_database(started, epoch, outdoor_c, outdoor_dew, outdoor_hum, indoor_c, indoor_dew, indoor_hum, indoor_press, outdoorUV, outdoor_wind, outdoor_windGust, indoor_gas, pi_temp_c, picow_temp_c)
-        post_WU(outdoor_c, outdoor_dew, outdoor_hum, indoor_press) # Post to Weather Underground
-        logging.info("Done updating databases")
-        create_graphs()
-        notify_flask()
-
-        ended = datetime.now() # Stop timing the operation
-        loop_time = (ended - started).seconds
-        logging.info(f"Loop took {loop_time} seconds")
-        # Compute the amount of time it took to run the loop above
-        # then sleep for the remaining time left
-        # if it is less than the configured loop interval
-        if started and ended and ended - started < interval:
-            remaining = interval.seconds - loop_time
-            logging.info(f"Sleeping for {remaining} seconds...")
-            time.sleep((interval - (ended - started)).seconds) # calculate this again (instead of using remaining var above) at the last moment so it's more precise
+        due = queue[0][0]
+        delay = due - time.monotonic()
+        if delay > 0:
+            logging.info(f"Sleeping for {delay:.2f} seconds...")
+            time.sleep(delay)
+        # If the wall clock was stepped (NTP sync after boot, manual change) re-align everything to it
+        if abs(wall_clock_offset() - clock_offset) > 1:
+            logging.warning(f"Wall clock jumped by {wall_clock_offset() - clock_offset:.2f} seconds, re-aligning schedule")
+            queue = build_queue()
+            continue
+        now = time.monotonic()
+        lateness = now - due
+        jitter = abs(lateness - last_lateness)
+        last_lateness = lateness
+        logging.info(f"Tick lateness: {lateness * 1000:.1f} ms, jitter: {jitter * 1000:.1f} ms")
+        if lateness > 1:
+            logging.warning(f"Tick started {lateness:.2f} seconds late")
+        # Pop every job due at this exact tick, then put each one back at its next time
+        jobs = []
+        while queue and queue[0][0] <= due + 0.001:
+            job_due, name = heapq.heappop(queue)
+            jobs.append(name)
+            heapq.heappush(queue, (reschedule(name, job_due, now), name))
+        run_tick(jobs, round(due + clock_offset)) # round() not int() so float error can't push the epoch into the previous bucket
 
 if __name__ == "__main__":
     try:
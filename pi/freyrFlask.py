@@ -1,9 +1,29 @@
-from flask import Flask, jsonify, render_template, send_from_directory
+from flask import Flask, jsonify, render_template, send_from_directory, Response, abort, request
 from flask_socketio import SocketIO
 import os
 import logging
 from logging.handlers import RotatingFileHandler
 import sqlite3
+import threading
+import math
+import sys
+import time
+import queue
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+import gzip
+from array import array
+import numpy as np
+import rrdtool
+import config
+from graphs import rrd_daemon_args, graph_definitions, graph_interval, graph_sources, graph_metrics, render_graph_image, RANGES, graph_name
+from sqlite_schema import archives
+from export import FIELDS, EXPORTERS
+import binstore
+try:
+    import brotli # Optional, gzip is used if it isn't installed
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 app.json.sort_keys = False # Don't sort the keys in the JSON response to alphabetical order
@@ -20,28 +40,115 @@ logging.warning("Starting freyrFlask") # Throw something in the log on start jus
 werkzeug_log = logging.getLogger('werkzeug')
 werkzeug_log.setLevel(logging.WARNING) # Set the logging level to WARNING or higher to reduce output
 
-def read_sqlite_database():
-    # Connect to SQLite db
+# Latest row of the data table, kept in memory so /api doesn't run the query on every request
+# Only served while PRAGMA data_version says nothing has been committed since it was read: freyr.py's notify can
+# arrive before its row is committed (group commit), so dropping it on notify alone could cache the old row again
+# Dropped on notify too, LATEST_ROW_MAX_AGE is a backstop
+LATEST_ROW_MAX_AGE = 120 # seconds
+latest_row = None
+latest_row_read = 0.0 # time.monotonic() when it was read
+latest_row_version = None # data_version when it was read
+latest_row_lock = threading.Lock() # Also makes concurrent requests after an invalidation share one read
+version_connection = None # data_version only compares within one connection, so this one is kept just for that
+
+# Changes whenever another connection (freyr.py) commits. Call with latest_row_lock held
+def data_version():
+    global version_connection
     try:
-        database = "./sql/freyr.db"
-        logging.info(f"Connecting to SQLite database: {database}")
-        connection = sqlite3.connect(database)
-        cursor = connection.cursor()
+        if version_connection is None:
+            version_connection = open_db_connection()
+        return version_connection.execute("PRAGMA data_version").fetchone()[0]
     except sqlite3.Error as e:
-        logging.error(f"Couldn't open SQLite database {database}: {e}")
-        return jsonify({"error": "Database connection failed"}), 500
-    # Read from SQLite db
+        logging.error(f"Error reading data_version: {e}")
+        if version_connection is not None:
+            close_db_connection(version_connection)
+            version_connection = None
+        return None # Unknown, so the row is read again
+
+def invalidate_latest_row():
+    global latest_row
+    with latest_row_lock:
+        latest_row = None
+
+# Pool of read-only SQLite connections
+# Opening a connection re-reads the schema every time, so a few are kept open and shared between requests
+# (werkzeug starts a new thread for every request, so they're pooled rather than kept per thread)
+# Each connection keeps its compiled statements (cached_statements), so repeat queries skip the parser
+DATABASE = config.DATABASE_PATH + config.DATABASE
+DB_POOL_SIZE = 2 # Connections kept open, extra concurrent requests open a temporary one
+db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE) # LIFO so the warmest connection is reused first
+db_stats = {"opened": 0, "reused": 0, "closed": 0}
+db_stats_lock = threading.Lock()
+
+def count_db(event):
+    with db_stats_lock:
+        db_stats[event] += 1
+        return dict(db_stats)
+
+def open_db_connection():
+    # mode=ro: never takes a write lock, so it can't block freyr.py
+    connection = sqlite3.connect(f"file:{DATABASE}?mode=ro", uri=True, check_same_thread=False, cached_statements=32, timeout=5)
+    connection.execute("PRAGMA query_only = ON")
+    connection.execute("PRAGMA cache_size = -2000") # 2 MB page cache per connection
+    stats = count_db("opened")
+    logging.info(f"Opened read-only SQLite connection to {DATABASE}. Pool stats: {stats}")
+    return connection
+
+def close_db_connection(connection):
+    connection.close()
+    stats = count_db("closed")
+    logging.info(f"Closed SQLite connection to {DATABASE}. Pool stats: {stats}")
+
+# Borrow a connection for the length of a 'with' block
+# A block that raised anything (an SQLite error, or GeneratorExit when a client drops a streamed export)
+# closes its connection instead of putting it back into the pool, so the opened/closed counts stay right
+@contextmanager
+def db_connection():
+    try:
+        connection = db_pool.get_nowait()
+        stats = count_db("reused")
+        logging.debug(f"Reusing pooled SQLite connection. Pool stats: {stats}")
+    except queue.Empty:
+        connection = open_db_connection()
+    returned = False
+    try:
+        yield connection
+        try:
+            db_pool.put_nowait(connection)
+            returned = True
+        except queue.Full:
+            pass
+    finally:
+        if not returned:
+            close_db_connection(connection)
+
+def query_latest_row():
     try:
-        logging.info(f"Reading from SQLite database: {database}")
-        result = cursor.execute("SELECT * FROM data ORDER BY rowid DESC LIMIT 1").fetchone()
-        logging.info(f"SQLite database {database} read successfully.")
+        logging.info(f"Reading from SQLite database: {DATABASE}")
+        epoch = history_column("epoch") # By epoch rather than rowid, data is a view without one on the compact schema (see sqlite_schema.py)
+        with db_connection() as connection:
+            result = connection.execute(f'SELECT * FROM data ORDER BY "{epoch}" DESC LIMIT 1').fetchone()
+        logging.info(f"SQLite database {DATABASE} read successfully.")
         logging.debug(f"Data: {result}")
     except sqlite3.Error as e:
         logging.error(f"Error reading SQLite database: {e}")
-        return jsonify({"error": "Error reading database"}), 500
-    finally:
-        connection.close()
-        logging.info(f"SQLite database {database} closed.")
+        return None, (jsonify({"error": "Error reading database"}), 500)
+    return result, None
+
+def read_sqlite_database():
+    global latest_row, latest_row_read, latest_row_version
+    with latest_row_lock:
+        version = data_version()
+        if (latest_row is not None and version is not None and version == latest_row_version
+                and time.monotonic() - latest_row_read < LATEST_ROW_MAX_AGE):
+            logging.debug("Latest row served from memory.")
+            result = latest_row
+        else:
+            result, error = query_latest_row() # Read after the version, so a commit in between only costs another read
+            if error:
+                return error
+            if result:
+                latest_row, latest_row_read, latest_row_version = result, time.monotonic(), version
     # Final error check and return JSON
     if result:
         logging.debug("JSON served successfully.")
@@ -66,24 +173,363 @@ def read_sqlite_database():
         logging.error("No data found in SQLite database.")
         return jsonify({"error": "No data found"}), 404
 
+# History out of SQLite, downsampled on the server
+HISTORY_MAX_POINTS = 10000
+history_columns = {} # field: column name in the data table, looked up once
+
+def history_column(field):
+    if not history_columns:
+        with db_connection() as connection:
+            names = [row[1] for row in connection.execute("PRAGMA table_info(data)")] # Ordered by cid
+        history_columns.update(zip(FIELDS, names))
+    return history_columns[field]
+
+# Runs 'query' (with a {schema} placeholder) against every archive for [start, end] and then freyr.db, rows all together
+# Months that have been moved out of freyr.db are read from their archive files, ATTACHed one at a time for the query
+def query_history(query, params, start, end):
+    rows = []
+    with db_connection() as connection:
+        for path in archives(start, end): # Oldest first, and all of them older than anything still in freyr.db
+            connection.execute("ATTACH DATABASE ? AS archive", (f"file:{path}?mode=ro",))
+            try:
+                rows += connection.execute(query.format(schema="archive"), params).fetchall()
+            finally:
+                connection.execute("DETACH DATABASE archive")
+        rows += connection.execute(query.format(schema="main"), params).fetchall()
+    return rows
+
+# (number of rows in [start, end], downsample()'d history), the epoch index keeps this a range scan instead of a full table scan
+# Missing readings were stored as the text 'U' (NULL on the compact schema), those are left out
+# SQLite does the bucketing itself, so only about 'points' rows ever reach Python however long the range is
+def read_history(field, start, end, points):
+    # The binary store (see binstore.py) turns the whole query into slicing a memory map, when it goes back far enough
+    if config.BINARY_STORE and os.path.exists(config.BINARY_STORE):
+        store = binstore.load(config.BINARY_STORE)
+        if start >= store[0]:
+            epochs, records = binstore.window(store, start, end)
+            values = records[field]
+            kept = ~np.isnan(values)
+            rows = np.column_stack((epochs[kept], np.round(values[kept].astype(np.float64), 3))) # float32, rounded so 21.16 doesn't come back as 21.159999
+            return len(rows), downsample(rows, start, end, points)
+    epoch = history_column("epoch")
+    column = history_column(field)
+    where = f'"{epoch}" BETWEEN ? AND ? AND typeof("{column}") IN (\'real\', \'integer\')'
+    width = (end - start + 1) / points
+    buckets = np.array(query_history(
+        f'SELECT CAST(("{epoch}" - ?) / ? AS INTEGER) AS bucket, MIN("{column}"), MAX("{column}"), SUM("{column}"), COUNT(*) FROM {{schema}}.data WHERE {where} GROUP BY bucket ORDER BY bucket',
+        (start, width, start, end), start, end), dtype=np.float64).reshape(-1, 5)
+    count = int(buckets[:, 4].sum())
+    if count <= points: # Already small enough, every row is its own bucket
+        rows = query_history(f'SELECT "{epoch}", "{column}" FROM {{schema}}.data WHERE {where} ORDER BY "{epoch}"', (start, end), start, end)
+        return count, downsample(np.array(rows, dtype=np.float64).reshape(-1, 2), start, end, points)
+    # A month boundary can split a bucket between an archive and freyr.db, those halves are merged here
+    index = buckets[:, 0]
+    firsts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    return count, {
+        "bucket": width,
+        "t": (start + index[firsts] * width).astype(np.int64).tolist(),
+        "min": np.minimum.reduceat(buckets[:, 1], firsts).tolist(),
+        "max": np.maximum.reduceat(buckets[:, 2], firsts).tolist(),
+        "avg": np.round(np.add.reduceat(buckets[:, 3], firsts) / np.add.reduceat(buckets[:, 4], firsts), 3).tolist()
+    }
+
+# Min/max/average buckets: splits [start, end] into 'points' equal time buckets
+# Keeps the peaks a plain average would smooth away, so a year of minutes still plots the real highs and lows
+def downsample(rows, start, end, points):
+    times, values = rows[:, 0], rows[:, 1]
+    if len(times) <= points: # Already small enough, every row is its own bucket
+        return {"bucket": None, "t": times.astype(np.int64).tolist(), "min": values.tolist(), "max": values.tolist(), "avg": values.tolist()}
+    width = (end - start + 1) / points
+    buckets = ((times - start) // width).astype(np.int64)
+    firsts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]]) # Rows are sorted, so each bucket is one run
+    counts = np.diff(np.r_[firsts, len(values)])
+    return {
+        "bucket": width,
+        "t": (start + buckets[firsts] * width).astype(np.int64).tolist(),
+        "min": np.minimum.reduceat(values, firsts).tolist(),
+        "max": np.maximum.reduceat(values, firsts).tolist(),
+        "avg": np.round(np.add.reduceat(values, firsts) / counts, 3).tolist()
+    }
+
+# On-demand graphs
+# A graph is only rendered when someone asks for it, then cached until one of its RRDs gets new data
+graphs = graph_definitions() # Built once, the arguments don't change while running
+graph_cache = {} # name: (last update of its RRDs when rendered, PNG bytes)
+graph_locks = {name: threading.Lock() for name in graphs} # Concurrent requests for the same graph share one render
+
+# Newest last-update time of the RRDs a graph reads, rounded down to the graph's redraw interval, used as the cache key
+# A 48 hour graph is redrawn on every new sample, a year long one once a day
+def graph_freshness(name):
+    last = max(rrdtool.last(*rrd_daemon_args(), rrd) for rrd in graph_sources(graphs[name]))
+    return last // graph_interval(name)
+
+# Returns (freshness, PNG bytes)
+def get_graph(name):
+    freshness = graph_freshness(name)
+    cached = graph_cache.get(name)
+    if cached and cached[0] == freshness:
+        logging.info(f"Graph {name} served from cache")
+        return cached
+    with graph_locks[name]:
+        cached = graph_cache.get(name) # Another request may have rendered it while we waited for the lock
+        if cached and cached[0] == freshness:
+            logging.info(f"Graph {name} served from cache")
+            return cached
+        logging.info(f"Rendering graph {name}")
+        image = render_graph_image(graphs[name])
+        graph_cache[name] = (freshness, image)
+        return graph_cache[name]
+
+# Time series straight out of the RRDs for drawing charts in the browser
+metrics = graph_metrics()
+
+# Read one or more metrics with rrdtool xport
+# Returns the xport dict: {'meta': {'start', 'end', 'step', 'rows', 'columns', 'legend'}, 'data': [(value, ...), ...]}
+def read_series(names, start, end, points, cf):
+    args = rrd_daemon_args() + ["--start", start, "--end", end, "--maxrows", str(points)]
+    for index, name in enumerate(names):
+        rrd, ds = metrics[name]
+        args += [f"DEF:m{index}={rrd}:{ds}:{cf}", f"XPORT:m{index}:{name}"]
+    return rrdtool.xport(*args)
+
+# HTTP caching and compression
+# Every JSON/HTML response gets an ETag (hash of the body) and graphs get one from their freshness,
+# then browsers revalidate with If-None-Match and get an empty 304 if nothing changed
+# JSON and HTML are compressed with brotli (if installed) or gzip
+index_cache = {} # (charts, range, encoding): (index.html encoded for that Content-Encoding, ETag), built once per version of the page
+COMPRESSIBLE = ('application/json', 'text/html')
+
+# Content-Encoding for this request: 'br', 'gzip' or None
+def response_encoding():
+    if brotli and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def encode(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def compress(response):
+    data = response.get_data()
+    if len(data) < 500: # Not worth it
+        return
+    encoding = response_encoding()
+    if not encoding:
+        return
+    response.set_data(encode(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak) # Each encoding is a different body, so a different ETag
+
+@app.after_request
+def http_caching(response):
+    if response.status_code != 200 or response.direct_passthrough: # Static files already handle this themselves
+        return response
+    if response.mimetype in COMPRESSIBLE and 'Content-Encoding' not in response.headers: # index() arrives already compressed
+        if not response.get_etag()[0]:
+            response.add_etag()
+        compress(response)
+    if response.get_etag()[0]:
+        response.headers.setdefault('Cache-Control', 'no-cache') # Cache it, but always check back first
+        response.make_conditional(request) # Turns it into a 304 if the browser's copy matches
+    return response
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    time_range = request.args.get('range', '48h')
+    if time_range not in RANGES:
+        abort(404)
+    charts = request.args.get('mode') == 'charts'
+    encoding = response_encoding()
+    # The page only depends on these two, so each version is rendered, hashed and compressed once and reused
+    key = (charts, time_range, encoding)
+    if key not in index_cache:
+        names = [graph_name(name, time_range) for name in ('temperatures', 'humidities', 'pressures', 'uv', 'wind', 'gas', 'pi')]
+        page = Response(render_template('index.html', on_demand=config.GRAPHS_ON_DEMAND, charts=charts,
+            graph_names=names, ranges=list(RANGES), time_range=time_range), mimetype='text/html')
+        page.add_etag()
+        etag = page.get_etag()[0]
+        body = page.get_data()
+        if encoding:
+            body, etag = encode(body, encoding), f"{etag}-{encoding}"
+        index_cache[key] = (body, etag)
+    body, etag = index_cache[key]
+    response = Response(body, mimetype='text/html')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    return response
 
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(os.path.join(app.root_path, 'static'),
         'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
+@app.route('/graphs/<name>.png')
+def graph(name):
+    if name not in graphs:
+        abort(404)
+    try:
+        freshness, image = get_graph(name)
+    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
+        logging.error(f"Error rendering graph {name}: {err}")
+        abort(500)
+    response = Response(image, mimetype='image/png')
+    response.set_etag(f"{name}-{freshness}")
+    return response
+
 @app.route('/api')
 def api():
     return read_sqlite_database()
 
+# /api/series?metric=temperatures.outdoor,temperatures.indoor&start=end-48h&end=now&points=720&cf=AVERAGE&format=json
+# start/end take anything rrdtool does (epoch seconds, 'now', 'end-7d', ...)
+# format=binary returns little-endian float32 rows (NaN for no data) with the layout in X-Series-* headers
+@app.route('/api/series')
+def api_series():
+    names = [name for name in request.args.get('metric', '').split(',') if name]
+    unknown = [name for name in names if name not in metrics]
+    if not names or unknown:
+        return jsonify({"error": f"Unknown metric(s): {unknown}", "metrics": list(metrics)}), 400
+    cf = request.args.get('cf', 'AVERAGE').upper()
+    if cf not in ('AVERAGE', 'MIN', 'MAX', 'LAST'):
+        return jsonify({"error": "cf must be AVERAGE, MIN, MAX or LAST"}), 400
+    try:
+        points = min(int(request.args.get('points', 1440)), 10000)
+    except ValueError:
+        return jsonify({"error": "points must be a number"}), 400
+    try:
+        series = read_series(names, request.args.get('start', 'end-48h'), request.args.get('end', 'now'), points, cf)
+    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
+        logging.error(f"Error reading series {names}: {err}")
+        return jsonify({"error": str(err)}), 400
+    meta = series['meta']
+    if request.args.get('format') == 'binary':
+        values = array('f', [math.nan if value is None else value for row in series['data'] for value in row])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        response = Response(values.tobytes(), mimetype='application/octet-stream')
+        response.headers['X-Series-Start'] = meta['start']
+        response.headers['X-Series-Step'] = meta['step']
+        response.headers['X-Series-Columns'] = ','.join(meta['legend'])
+        return response
+    return jsonify({
+        "start": meta['start'],
+        "step": meta['step'],
+        "metrics": meta['legend'],
+        "data": [[None if value is None or math.isnan(value) else round(value, 2) for value in row] for row in series['data']] # JSON has no NaN
+    })
+
+# /api/history?metric=outdoorTemp&start=1700000000&end=1700086400&points=1000
+# start/end are epoch seconds (default: the last 24 hours), metric is any /api field
+@app.route('/api/history')
+def api_history():
+    field = request.args.get('metric')
+    if field not in FIELDS[2:]:
+        return jsonify({"error": f"Unknown metric: {field}", "metrics": FIELDS[2:]}), 400
+    try:
+        end = int(request.args.get('end', time.time()))
+        start = int(request.args.get('start', end - 86400))
+        points = max(1, min(int(request.args.get('points', 1000)), HISTORY_MAX_POINTS))
+    except ValueError:
+        return jsonify({"error": "start, end and points must be numbers"}), 400
+    if start > end:
+        return jsonify({"error": "start must be before end"}), 400
+    try:
+        started = time.monotonic()
+        rows, history = read_history(field, start, end, points)
+        logging.info(f"History of {field}: {rows} rows down to {len(history['t'])} points in {time.monotonic() - started:.3f} seconds")
+    except sqlite3.Error as e:
+        logging.error(f"Error reading history: {e}")
+        return jsonify({"error": "Error reading database"}), 500
+    return jsonify({"metric": field, "start": start, "end": end, "rows": rows, **history})
+
+# /api/export?format=csv&start=1700000000&end=1700086400
+# Every row in [start, end] (epoch seconds, default: everything), streamed with chunked transfer encoding
+# straight out of export.py's generators, so memory use doesn't grow with the range. format is csv, ndjson or npy
+@app.route('/api/export')
+def api_export():
+    format = request.args.get('format', 'csv')
+    if format not in EXPORTERS:
+        return jsonify({"error": f"Unknown format: {format}", "formats": list(EXPORTERS)}), 400
+    try:
+        end = int(request.args.get('end', time.time()))
+        start = int(request.args.get('start', 0))
+    except ValueError:
+        return jsonify({"error": "start and end must be numbers"}), 400
+    exporter, mimetype = EXPORTERS[format]
+    def stream():
+        started = time.monotonic()
+        with db_connection() as connection: # Held until the last chunk is sent
+            yield from exporter(connection, start, end)
+        logging.info(f"Exported {start}-{end} as {format} in {time.monotonic() - started:.1f} seconds")
+    return Response(stream(), mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=freyr-{start}-{end}.{format}"})
+
+# High/low stats from the collector's hourly and daily rollup tables, a handful of rows instead of a table scan
+# period: which table to read and where the period starts (epoch seconds)
+def stats_period(period):
+    now = datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    periods = {
+        "hour": ("rollup_hourly", now.replace(minute=0, second=0, microsecond=0)),
+        "24h": ("rollup_hourly", now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=23)),
+        "today": ("rollup_daily", today),
+        "week": ("rollup_daily", today - timedelta(days=6)),
+        "month": ("rollup_daily", today.replace(day=1)),
+        "year": ("rollup_daily", today.replace(month=1, day=1)),
+        "all": ("rollup_daily", datetime.fromtimestamp(0))
+    }
+    if period not in periods:
+        return None, None
+    table, start = periods[period]
+    return table, int(start.timestamp())
+
+# /api/stats?period=today (hour, 24h, today, week, month, year or all)
+@app.route('/api/stats')
+def api_stats():
+    period = request.args.get('period', 'today')
+    table, start = stats_period(period)
+    if table is None:
+        return jsonify({"error": f"Unknown period: {period}", "periods": ["hour", "24h", "today", "week", "month", "year", "all"]}), 400
+    try:
+        with db_connection() as connection:
+            rows = connection.execute(
+                f"SELECT metric, MIN(min), MAX(max), SUM(sum) / SUM(count), SUM(count) FROM {table} WHERE bucket >= ? GROUP BY metric",
+                (start,)).fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Error reading stats: {e}")
+        return jsonify({"error": "Error reading database"}), 500
+    stats = {metric: {"min": low, "max": high, "avg": round(average, 3), "count": count} for metric, low, high, average, count in rows}
+    return jsonify({"period": period, "start": start, "stats": stats})
+
 # Inter-process communication with 'freyr.py'
+# Version of a graph's image for the browser to put in its URL, so a reload is a new URL only when the image itself
+# changed and anything else is revalidated (ETag/304) instead of downloaded again. None if it can't be told
+def graph_version(name):
+    try:
+        if config.GRAPHS_ON_DEMAND:
+            return int(graph_freshness(name)) # Same thing graph() builds its ETag from
+        return int(os.path.getmtime(config.GRAPH_PATH + name + ".png")) # Written by freyr.py's renderer
+    except (KeyError, OSError, rrdtool.OperationalError) as err:
+        logging.error(f"Couldn't get the version of graph {name}: {err}")
+        return None
+
 @app.route('/notify', methods=['POST'])
 def notify():
-    logging.info("Received notification of new images.")
-    socketio.emit('new_images') # Will trigger images in page to refresh
+    data = request.get_json(silent=True) or {}
+    images = data.get('images', list(graphs)) # Older collectors don't say which images changed, so refresh them all
+    reading = data.get('reading') # Latest values, so clients don't have to come back and ask /api
+    invalidate_latest_row() # There's a new row in the database
+    logging.info(f"Received notification of new images: {images}")
+    versions = {name: graph_version(name) for name in images}
+    socketio.emit('new_images', {'images': images, 'versions': versions, 'reading': reading}) # Will trigger the changed images in page to refresh
     logging.info("Emitted notification to browser to refresh images.")
     return 'Notified clients', 200
 
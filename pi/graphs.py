@@ -0,0 +1,225 @@
+# Graph definitions shared by 'freyr.py' (renders every graph on a schedule)
+# and 'freyrFlask.py' (renders graphs on demand)
+import config
+import rrdtool
+import re
+import time
+
+# Extra rrdtool arguments to go through rrdcached when config.RRDCACHED is set
+# Updates are queued in the daemon and written in batches, graphs flush only the RRDs they read
+def rrd_daemon_args():
+    return ["--daemon", config.RRDCACHED] if config.RRDCACHED else []
+
+# Every graph, declared once
+# rrd: RRD file (without '.rrd') all of the graph's lines come from
+# lines: (data source, color, legend) for each line
+# format: GPRINT format for the stats, fahrenheit: also print each stat converted to °F
+# stats: consolidation functions printed after each line, LAST = current value
+GRAPHS = {
+    "temperatures": {
+        "rrd": "temperatures",
+        "title": "Temperature",
+        "vertical_label": "Celsius",
+        "right_axis_label": "Fahrenheit",
+        "right_axis": "1.8:32",
+        "height": 380,
+        "lines": [
+            ("outdoor", "#ff0000", "Outdoor         "),
+            ("outdoor_dew", "#ff00ff", "Outdoor Dewpoint"),
+            ("indoor", "#0000ff", "Indoor          "),
+            ("indoor_dew", "#00ffff", "Indoor Dewpoint ")
+        ],
+        "format": "%5.2lf °C",
+        "fahrenheit": True,
+        "stats": ["LAST", "MAX", "MIN"]
+    },
+    "humidities": {
+        "rrd": "humidities",
+        "title": "Humidity",
+        "vertical_label": "Relative (%)",
+        "right_axis_label": "Relative (%)",
+        "right_axis": "1:0",
+        "height": 300,
+        "lines": [
+            ("outdoor", "#ff0000", "Outdoor"),
+            ("indoor", "#0000ff", "Indoor ")
+        ],
+        "format": "%.1lf%%",
+        "stats": ["LAST", "MAX", "MIN"]
+    },
+    "pressures": {
+        "rrd": "pressures",
+        "title": "Barometric Pressure (MSL)",
+        "vertical_label": "hPa",
+        "right_axis_label": "hPa",
+        "right_axis": "1:0",
+        "height": 300,
+        "extra": ["--right-axis-format", "%4.0lf", "--lower-limit", "998", "--upper-limit", "1018", "--y-grid", "1:2", "--units-exponent", "0"],
+        "lines": [("indoor", "#00ff00", "Local")],
+        "format": "%.2lf hPa",
+        "stats": ["LAST", "MAX", "MIN"]
+    },
+    "gas": {
+        "rrd": "gas",
+        "title": "Gas Resistance",
+        "vertical_label": "Ω",
+        "right_axis_label": "Ω",
+        "right_axis": "1:0",
+        "height": 250,
+        "lines": [("indoor", "#0000ff", "Indoor")],
+        "format": "%.1lf%s Ω",
+        "stats": ["LAST", "MAX", "MIN"]
+    },
+    "wind": {
+        "rrd": "wind",
+        "title": "Wind Speeds",
+        "vertical_label": "Miles Per Hour",
+        "right_axis_label": "Miles Per Hour",
+        "right_axis": "1:0",
+        "height": 250,
+        "lines": [
+            ("outdoor_wind", "#0000ff", "Wind"),
+            ("outdoor_windGust", "#ff0000", "Gust ")
+        ],
+        "format": "%.1lf",
+        "stats": ["LAST", "MAX", "MIN"]
+    },
+    "uv": {
+        "rrd": "uv",
+        "title": "UV Index",
+        "vertical_label": "Index",
+        "right_axis_label": "Index",
+        "right_axis": "1:0",
+        "height": 250,
+        "lines": [("outdoor", "#ffa500", "Outdoor")],
+        "format": "%.1lf",
+        "stats": ["LAST", "MAX"]
+    },
+    "pi": {
+        "rrd": "temperatures",
+        "title": "Pi Temperatures",
+        "vertical_label": "Celsius",
+        "right_axis_label": "Fahrenheit",
+        "right_axis": "1.8:32",
+        "height": 150,
+        "lines": [
+            ("picow", "#ff0000", "Pico W MCU"),
+            ("pi", "#0000ff", "Zero W CPU")
+        ],
+        "format": "%5.2lf °C",
+        "fahrenheit": True,
+        "stats": ["LAST", "MAX", "MIN"]
+    }
+}
+
+# Time ranges every graph is drawn for
+# The 48 hour graphs keep their old file names, the others get the range as a suffix (temperatures_7d.png)
+# interval: how often (seconds) a range is worth redrawing, a year long graph barely moves in an hour
+RANGES = {
+    "48h": {"start": "end-48h", "x_grid": "MINUTE:30:HOUR:1:HOUR:2:0:%H:00", "interval": 60},
+    "7d": {"start": "end-7d", "x_grid": "HOUR:6:DAY:1:DAY:1:86400:%a %d", "interval": 900},
+    "30d": {"start": "end-30d", "x_grid": "DAY:1:WEEK:1:WEEK:1:604800:%b %d", "interval": 3600},
+    "1y": {"start": "end-1y", "x_grid": "MONTH:1:MONTH:1:MONTH:1:2592000:%b", "interval": 86400}
+}
+
+STAT_LABELS = {"LAST": "Cur", "MAX": "Max", "MIN": "Min"}
+
+def graph_name(name, range_name):
+    return name if range_name == "48h" else f"{name}_{range_name}"
+
+# Turn one graph spec into rrdtool arguments for one time range
+# Lines are drawn from the AVERAGE RRAs and the high/low stats read the MAX/MIN RRAs,
+# so long ranges use the pre-consolidated rows from rrd_schema.py instead of raw samples
+def compile_graph(spec, time_range):
+    rrd = f"{config.RRD_PATH}{spec['rrd']}.rrd"
+    args = [
+        "--end", "now", "--start", time_range["start"],
+        "--width", "1440",
+        "--font", "DEFAULT:10:",
+        "--font", "AXIS:8:",
+        "--x-grid", time_range["x_grid"],
+        "--alt-autoscale",
+        "--border", "0",
+        "--slope-mode",
+        "-c", "BACK#333333",
+        "-c", "CANVAS#18191A",
+        "-c", "FONT#DDDDDD",
+        "-c", "GRID#DDDDDD1A",
+        "-c", "MGRID#DDDDDD33",
+        "-c", "FRAME#18191A",
+        "-c", "ARROW#333333",
+        "--disable-rrdtool-tag",
+        *rrd_daemon_args(), # Flushes just the RRDs each graph reads out of rrdcached
+        "--title", spec["title"],
+        "--vertical-label", spec["vertical_label"],
+        "--right-axis-label", spec["right_axis_label"],
+        "--right-axis", spec["right_axis"],
+        "--height", str(spec["height"]),
+        *spec.get("extra", [])
+    ]
+    for ds, color, legend in spec["lines"]:
+        args += [f"DEF:{ds}={rrd}:{ds}:AVERAGE", f"DEF:{ds}Max={rrd}:{ds}:MAX", f"DEF:{ds}Min={rrd}:{ds}:MIN"]
+        if spec.get("fahrenheit"):
+            args += [f"CDEF:{ds}-f={ds},1.8,*,32,+", f"CDEF:{ds}Max-f={ds}Max,1.8,*,32,+", f"CDEF:{ds}Min-f={ds}Min,1.8,*,32,+"]
+    for ds, color, legend in spec["lines"]:
+        args.append(f"LINE1:{ds}{color}:{legend}")
+        for index, stat in enumerate(spec["stats"]):
+            vname = {"LAST": ds, "MAX": f"{ds}Max", "MIN": f"{ds}Min"}[stat]
+            end = "\\l" if index == len(spec["stats"]) - 1 else ""
+            if spec.get("fahrenheit"):
+                args.append(f"GPRINT:{vname}:{stat}:{STAT_LABELS[stat]}\\: {spec['format']}")
+                args.append(f"GPRINT:{vname}-f:{stat}: %5.1lf °F{end}")
+            else:
+                args.append(f"GPRINT:{vname}:{stat}:{STAT_LABELS[stat]}\\: {spec['format']}{end}")
+    return args
+
+# rrdtool arguments for every graph and range, keyed by graph name (the PNG's file name without '.png')
+# Compiled the first time they're asked for and reused from then on
+compiled_graphs = {}
+compiled_intervals = {}
+
+def graph_definitions():
+    if not compiled_graphs:
+        for range_name, time_range in RANGES.items():
+            for name, spec in GRAPHS.items():
+                compiled_graphs[graph_name(name, range_name)] = compile_graph(spec, time_range)
+                compiled_intervals[graph_name(name, range_name)] = time_range["interval"]
+    return compiled_graphs
+
+# How often (seconds) a graph is worth redrawing
+def graph_interval(name):
+    graph_definitions()
+    return compiled_intervals[name]
+
+# Render one graph to a file, runs in one of the collector's renderer processes
+# Returns (output file, seconds it took, rrdtool result or None, error or None) so the collector can log it
+def render_graph(path, args):
+    started = time.monotonic()
+    try:
+        result = rrdtool.graph(path, args) # Always written: changed_graphs() already picked only graphs with new data
+        return path, time.monotonic() - started, result, None
+    except (rrdtool.ProgrammingError, rrdtool.OperationalError) as err:
+        return path, time.monotonic() - started, None, str(err)
+
+# RRD files a graph reads, from its DEF arguments
+def graph_sources(args):
+    sources = set()
+    for arg in args:
+        match = re.match(r"DEF:[^=]+=(.+\.rrd):", arg)
+        if match:
+            sources.add(match.group(1))
+    return sorted(sources)
+
+# Render one graph to PNG bytes in memory
+def render_graph_image(args):
+    return rrdtool.graphv("-", args)["image"]
+
+# Every metric the graphs read, as 'rrd.ds' (for example 'temperatures.outdoor'): (RRD file, data source)
+def graph_metrics():
+    metrics = {}
+    for args in graph_definitions().values():
+        for arg in args:
+            match = re.match(r"DEF:[^=]+=(.+/(\w+)\.rrd):(\w+):", arg)
+            if match:
+                metrics[f"{match.group(2)}.{match.group(3)}"] = (match.group(1), match.group(3))
+    return metrics
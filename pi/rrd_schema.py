@@ -0,0 +1,126 @@
+# Creates the RRDs freyr writes to and migrates old ones to the multi-resolution layout
+# Run from the same directory as 'freyr.py' (uses config.RRD_PATH), with freyr stopped:
+#   python rrd_schema.py check    - show which RRDs are missing or still on the old layout
+#   python rrd_schema.py create   - create any RRDs that don't exist yet
+#   python rrd_schema.py migrate  - rebuild old RRDs with the new RRAs, keeping their data (old file kept as .bak)
+import config
+import rrdtool
+import os
+import sys
+
+STEP = 60 # seconds, one sample per aligned minute
+
+# Data sources for each RRD, in the same order freyr.py writes the values
+SCHEMA = {
+    "temperatures.rrd": [
+        "DS:outdoor:GAUGE:120:-20:55",
+        "DS:indoor:GAUGE:120:0:55",
+        "DS:pi:GAUGE:120:0:100",
+        "DS:picow:GAUGE:120:0:100",
+        "DS:outdoor_dew:GAUGE:120:-80:55",
+        "DS:indoor_dew:GAUGE:120:-80:55"
+    ],
+    "humidities.rrd": [
+        "DS:outdoor:GAUGE:120:0:100",
+        "DS:indoor:GAUGE:120:0:100"
+    ],
+    "pressures.rrd": ["DS:indoor:GAUGE:120:900:1100"],
+    "gas.rrd": ["DS:indoor:GAUGE:120:50:200000"],
+    "uv.rrd": ["DS:outdoor:GAUGE:120:0:20"],
+    "wind.rrd": [
+        "DS:outdoor_wind:GAUGE:120:0:100",
+        "DS:outdoor_windGust:GAUGE:120:0:100"
+    ]
+}
+
+# (steps per row, rows) for each resolution
+RESOLUTIONS = [
+    (1, 2880), # 1 minute for 2 days
+    (5, 2016), # 5 minutes for 7 days
+    (60, 8784), # 1 hour for a year (leap year included)
+    (1440, 3660) # 1 day for 10 years
+]
+
+# LAST at full resolution for the current value, AVERAGE/MIN/MAX at every resolution
+# so long ranges and high/low stats read pre-consolidated rows instead of scanning raw samples
+RRAS = ["RRA:LAST:0.5:1:2880"] + [f"RRA:{cf}:0.5:{steps}:{rows}" for steps, rows in RESOLUTIONS for cf in ("AVERAGE", "MIN", "MAX")]
+
+# Set of (cf, steps per row, rows) in an existing RRD
+def existing_rras(path):
+    info = rrdtool.info(path)
+    rras = set()
+    index = 0
+    while f"rra[{index}].cf" in info:
+        rras.add((info[f"rra[{index}].cf"], info[f"rra[{index}].pdp_per_row"], info[f"rra[{index}].rows"]))
+        index += 1
+    return rras
+
+# DS definitions of an existing RRD, in index order, so a migration never changes the layout values are written in
+def existing_ds(path):
+    info = rrdtool.info(path)
+    ds = {}
+    for key, value in info.items():
+        if key.startswith("ds[") and key.endswith("].index"):
+            ds[value] = key[3:-len("].index")]
+    definitions = []
+    for index in sorted(ds):
+        name = ds[index]
+        minimum = info[f"ds[{name}].min"]
+        maximum = info[f"ds[{name}].max"]
+        minimum = "U" if minimum is None else minimum
+        maximum = "U" if maximum is None else maximum
+        definitions.append(f"DS:{name}:{info[f'ds[{name}].type']}:{info[f'ds[{name}].minimal_heartbeat']}:{minimum}:{maximum}")
+    return definitions
+
+def wanted_rras():
+    rras = set()
+    for rra in RRAS:
+        _, cf, _, steps, rows = rra.split(":")
+        rras.add((cf, int(steps), int(rows)))
+    return rras
+
+def is_current(path):
+    return wanted_rras() <= existing_rras(path)
+
+def check():
+    for rrd_filename in SCHEMA:
+        path = config.RRD_PATH + rrd_filename
+        if not os.path.exists(path):
+            print(f"{rrd_filename}: missing")
+        elif is_current(path):
+            print(f"{rrd_filename}: up to date")
+        else:
+            print(f"{rrd_filename}: old layout, needs migrating")
+
+def create():
+    for rrd_filename, ds in SCHEMA.items():
+        path = config.RRD_PATH + rrd_filename
+        if os.path.exists(path):
+            print(f"{rrd_filename}: exists, skipping")
+            continue
+        rrdtool.create(path, "--step", str(STEP), *ds, *RRAS)
+        print(f"{rrd_filename}: created")
+
+# rrdtool create --source copies every matching DS out of the old RRD into the new RRAs
+# Needs rrdtool 1.5 or newer
+def migrate():
+    for rrd_filename in SCHEMA:
+        path = config.RRD_PATH + rrd_filename
+        if not os.path.exists(path):
+            print(f"{rrd_filename}: missing, run 'create' first")
+            continue
+        if is_current(path):
+            print(f"{rrd_filename}: up to date, skipping")
+            continue
+        new_path = path + ".new"
+        rrdtool.create(new_path, "--step", str(STEP), "--start", str(rrdtool.last(path)), "--source", path, *existing_ds(path), *RRAS)
+        os.replace(path, path + ".bak")
+        os.replace(new_path, path)
+        print(f"{rrd_filename}: migrated, old file kept as {rrd_filename}.bak")
+
+if __name__ == "__main__":
+    commands = {"check": check, "create": create, "migrate": migrate}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        print(f"Usage: python {sys.argv[0]} {'|'.join(commands)}")
+        sys.exit(1)
+    commands[sys.argv[1]]()
@@ -0,0 +1,192 @@
+# Compact SQLite schema for freyr.db and the migration to it
+# Run from the same directory as 'freyr.py' (uses config.DATABASE_PATH), with freyr and freyrFlask stopped:
+#   python sqlite_schema.py check    - show which schema the database is on
+#   python sqlite_schema.py measure  - file size and full scan time of the data
+#   python sqlite_schema.py migrate  - move the data table to the compact schema (old file kept as .bak)
+#   python sqlite_schema.py archive  - move months older than config.SQLITE_ARCHIVE_MONTHS into their archive files
+#
+# Schema 0 (original): 'data' table with rowid, the datetime as text, epoch and 13 REAL columns, 'U' for no data
+# Schema 2 (compact): 'samples' table keyed by epoch WITHOUT ROWID, readings stored as scaled integers, NULL for no data
+#   A 'data' view decodes it back into the original columns, so readers don't need to know which schema they're on
+#
+# Archives: freyr.db only keeps the last few months, older rows live in one database per (local) month
+# with the same schema, named by config.SQLITE_ARCHIVE_FILE. Readers ATTACH the ones a time range needs
+import config
+import sqlite3
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+COMPACT_VERSION = 2 # PRAGMA user_version of a database on the compact schema
+
+# Column, scale for every reading, in the same order as the original data table (after the datetime and epoch)
+# Scaled integers: 21.37 °C is stored as 2137, 1013.2 hPa as 10132. SQLite stores small integers in 1-3 bytes instead of 8
+COLUMNS = [
+    ("outdoor_temp", 100), # centidegrees C
+    ("outdoor_dew", 100),
+    ("outdoor_hum", 10), # tenths of a %
+    ("indoor_temp", 100),
+    ("indoor_dew", 100),
+    ("indoor_hum", 10),
+    ("pressure", 10), # tenths of hPa
+    ("uv", 10),
+    ("wind", 10), # tenths of mph
+    ("wind_gust", 10),
+    ("gas", 1), # ohms
+    ("pi_temp", 100),
+    ("picow_temp", 100)
+]
+
+CREATE_SAMPLES = "CREATE TABLE samples (epoch INTEGER PRIMARY KEY, " + ", ".join(f"{column} INTEGER" for column, scale in COLUMNS) + ") WITHOUT ROWID"
+CREATE_VIEW = ("CREATE VIEW data AS SELECT datetime(epoch, 'unixepoch', 'localtime') AS started, epoch, "
+    + ", ".join(f"{column} / {float(scale)} AS {column}" for column, scale in COLUMNS) + " FROM samples")
+INSERT_SAMPLE = "INSERT INTO samples VALUES (" + ", ".join("?" * (len(COLUMNS) + 1)) + ")"
+
+# Value as stored in the samples table, None for no data ('U')
+def encode(value, scale):
+    if value == 'U' or value is None:
+        return None
+    return round(value * scale)
+
+def encode_row(epoch, values):
+    return (epoch, *(encode(value, scale) for value, (column, scale) in zip(values, COLUMNS)))
+
+def schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+def check(connection):
+    version = schema_version(connection)
+    print(f"Schema {version}: {'compact' if version == COMPACT_VERSION else 'original'}")
+
+# Best of a few runs of an AVG over every reading column of a table or view, in seconds
+def time_scan(connection, table):
+    columns = ", ".join(f'AVG("{row[1]}")' for row in connection.execute(f"PRAGMA table_info({table})").fetchall()[2:])
+    runs = []
+    for _ in range(3):
+        started = time.monotonic()
+        connection.execute(f"SELECT {columns} FROM {table}").fetchone()
+        runs.append(time.monotonic() - started)
+    return min(runs)
+
+# Size on disk and how long a full scan of every reading takes
+# On the compact schema that's the stored integers in samples, decoding through the data view is timed separately
+def measure(connection, path):
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)") # Count everything in the main file
+    size = os.path.getsize(path)
+    rows = connection.execute("SELECT COUNT(*) FROM data").fetchone()[0]
+    compact = schema_version(connection) == COMPACT_VERSION
+    scan = time_scan(connection, "samples" if compact else "data")
+    print(f"{rows} rows, {size / 1048576:.2f} MB ({size / max(rows, 1):.1f} bytes/row), full scan {scan * 1000:.0f} ms")
+    if compact:
+        print(f"Full scan decoded through the data view {time_scan(connection, 'data') * 1000:.0f} ms")
+    return size, scan
+
+def migrate(connection, path):
+    if schema_version(connection) == COMPACT_VERSION:
+        print("Already on the compact schema")
+        return
+    print("Before:")
+    before_size, before_scan = measure(connection, path)
+    backup = sqlite3.connect(path + ".bak")
+    connection.backup(backup)
+    backup.close()
+    print(f"Backed up to {path}.bak")
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(data)").fetchall()]
+    epoch = columns[1]
+    encoded = ", ".join(
+        f"""CASE WHEN typeof("{old}") IN ('real', 'integer') THEN CAST(round("{old}" * {scale}) AS INTEGER) END"""
+        for old, (column, scale) in zip(columns[2:], COLUMNS))
+    with connection: # One transaction, all or nothing
+        connection.execute(CREATE_SAMPLES)
+        connection.execute(f'INSERT OR IGNORE INTO samples SELECT "{epoch}", {encoded} FROM data ORDER BY "{epoch}"') # Duplicate epochs keep the first row
+        connection.execute("DROP TABLE data") # Takes its indexes with it
+        connection.execute(CREATE_VIEW)
+        connection.execute(f"PRAGMA user_version = {COMPACT_VERSION}")
+    connection.execute("VACUUM") # Give the space back
+    print("After:")
+    after_size, after_scan = measure(connection, path)
+    print(f"Size {after_size / before_size:.0%} of before, scan {after_scan / max(before_scan, 1e-9):.0%} of before")
+
+# Table the rows are actually stored in
+def raw_table(connection):
+    return "samples" if schema_version(connection) == COMPACT_VERSION else "data"
+
+def archive_path(year, month):
+    return config.DATABASE_PATH + config.SQLITE_ARCHIVE_FILE.format(year=year, month=month)
+
+# Epoch of local midnight on the 1st, month may run past 12 or below 1
+def month_start(year, month):
+    year, month = divmod(year * 12 + month - 1, 12)
+    return int(datetime(year, month + 1, 1).timestamp())
+
+# (year, month) of every local month [start, end] touches, oldest first
+def months(start, end):
+    day = datetime.fromtimestamp(max(start, 0)).date().replace(day=1)
+    last = datetime.fromtimestamp(end).date()
+    while day <= last:
+        yield day.year, day.month
+        day = (day + timedelta(days=32)).replace(day=1)
+
+# Archive files that exist for [start, end], oldest first
+def archives(start, end):
+    paths = (archive_path(year, month) for year, month in months(start, end))
+    return [path for path in paths if os.path.exists(path)]
+
+# Same tables, view and index as the live database, copied out of its sqlite_master
+def create_archive(connection, path):
+    statements = connection.execute(
+        "SELECT sql FROM main.sqlite_master WHERE tbl_name IN ('data', 'samples') AND sql IS NOT NULL ORDER BY type = 'view', type = 'index'").fetchall()
+    archive = sqlite3.connect(path)
+    with archive:
+        for (sql,) in statements:
+            archive.execute(sql)
+        archive.execute(f"PRAGMA user_version = {schema_version(connection)}")
+    archive.close()
+
+# Moves every month before the last 'keep_months' (the current one included) out of the live database
+# Each month is copied, committed, then deleted: if that gets interrupted the next run copies the month again
+# over what was already archived, so nothing is lost or duplicated
+def archive(connection, keep_months):
+    table = raw_table(connection)
+    epoch = connection.execute("PRAGMA table_info(data)").fetchall()[1][1]
+    today = datetime.now()
+    cutoff = month_start(today.year, today.month - keep_months + 1)
+    oldest = connection.execute(f'SELECT MIN("{epoch}") FROM main.{table}').fetchone()[0]
+    if oldest is None or oldest >= cutoff:
+        return []
+    archived = []
+    for year, month in months(oldest, cutoff - 1):
+        path = archive_path(year, month)
+        if not os.path.exists(path):
+            create_archive(connection, path)
+        start, end = month_start(year, month), month_start(year, month + 1)
+        connection.execute("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            with connection:
+                connection.execute(f'DELETE FROM archive.{table} WHERE "{epoch}" >= ? AND "{epoch}" < ?', (start, end))
+                rows = connection.execute(f'INSERT INTO archive.{table} SELECT * FROM main.{table} WHERE "{epoch}" >= ? AND "{epoch}" < ?', (start, end)).rowcount
+            with connection:
+                connection.execute(f'DELETE FROM main.{table} WHERE "{epoch}" >= ? AND "{epoch}" < ?', (start, end))
+        finally:
+            connection.execute("DETACH DATABASE archive")
+        archived.append((path, rows))
+    return archived
+
+if __name__ == "__main__":
+    commands = ["check", "measure", "migrate", "archive"]
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        print(f"Usage: python {sys.argv[0]} {'|'.join(commands)}")
+        sys.exit(1)
+    path = config.DATABASE_PATH + config.DATABASE
+    connection = sqlite3.connect(path)
+    if sys.argv[1] == "check":
+        check(connection)
+    elif sys.argv[1] == "measure":
+        measure(connection, path)
+    elif sys.argv[1] == "migrate":
+        migrate(connection, path)
+    else:
+        for archive_file, rows in archive(connection, config.SQLITE_ARCHIVE_MONTHS):
+            print(f"{rows} rows moved to {archive_file}")
+    connection.close()